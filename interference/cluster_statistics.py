@@ -0,0 +1,134 @@
+import numpy
+
+from typing import Dict, Optional, Sequence, Tuple
+
+from interference.metrics.match import normalized_rows
+
+
+class ClusterStatistics:
+    """
+    Running sums over the embeddings of each cluster, kept up to date as
+    tags are added, moved and removed, so cohesion metrics can be read in
+    O(clusters) instead of from the embeddings.
+
+    Per cluster it keeps the number of tags, the sum of the normalised
+    embeddings and how many of them are non-zero; with `second_moments` it
+    also keeps the sum of their outer products, which costs O(d^2) per
+    change but gives the standard deviation of the similarities too.
+    """
+
+    def __init__(self, second_moments: bool = False) -> None:
+        self.second_moments = second_moments
+
+        self.counts: Dict[int, int] = {}
+        self.sums: Dict[int, numpy.ndarray] = {}
+        self.nonzero: Dict[int, int] = {}
+        self.moments: Dict[int, numpy.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def clear(self) -> None:
+        self.counts.clear()
+        self.sums.clear()
+        self.nonzero.clear()
+        self.moments.clear()
+
+    def add(self, cluster_id: int, embedding: numpy.ndarray) -> None:
+        self._accumulate_one(cluster_id, embedding, 1)
+
+    def remove(self, cluster_id: int, embedding: numpy.ndarray) -> None:
+        self._accumulate_one(cluster_id, embedding, -1)
+
+    def add_many(self, cluster_ids: Sequence[int], embeddings: numpy.ndarray) -> None:
+        self._accumulate(cluster_ids, embeddings, 1)
+
+    def remove_many(self, cluster_ids: Sequence[int], embeddings: numpy.ndarray) -> None:
+        self._accumulate(cluster_ids, embeddings, -1)
+
+    def similarity_statistics(self, cluster_id: int) -> Tuple[float, Optional[float]]:
+        """
+        The mean and standard deviation of `similarity_metric` over the pairs
+        of distinct tags in the cluster, the same values as
+        `similarity_statistics` over its embeddings. The deviation is None
+        without `second_moments`. Clusters with a single tag give (1, 0).
+        """
+        count = self.counts[cluster_id]
+
+        if count < 2:
+            return 1.0, 0.0
+
+        pairs = count * (count - 1) / 2
+        total = self.sums[cluster_id]
+        nonzero = self.nonzero[cluster_id]
+
+        mean = (total @ total - nonzero) / 2 / pairs
+
+        if not self.second_moments:
+            return float(mean), None
+
+        moments = self.moments[cluster_id]
+        squares_sum = (numpy.einsum('de,de->', moments, moments) - nonzero) / 2
+
+        return float(mean), float(numpy.sqrt(max(squares_sum / pairs - mean ** 2, 0.0)))
+
+    def _accumulate_one(self, cluster_id: int, embedding: numpy.ndarray, sign: int) -> None:
+
+        embedding = numpy.asarray(embedding, dtype=numpy.float64).reshape(-1)
+        norm = numpy.sqrt(embedding @ embedding)
+
+        unit = embedding / norm if norm > 0 else numpy.zeros_like(embedding)
+
+        self._apply(cluster_id, sign, 1, unit, int(norm > 0), unit[None, :] if self.second_moments else None)
+
+    def _accumulate(self, cluster_ids: Sequence[int], embeddings: numpy.ndarray, sign: int) -> None:
+        if len(cluster_ids) == 0:
+            return
+
+        units = normalized_rows(numpy.asarray(embeddings).reshape(len(cluster_ids), -1))
+        nonzero = numpy.einsum('nd,nd->n', units, units) > 0.5
+
+        ids, positions = numpy.unique(numpy.asarray(cluster_ids), return_inverse=True)
+        positions = positions.reshape(-1)
+
+        sums = numpy.zeros((len(ids), units.shape[1]))
+        numpy.add.at(sums, positions, units)
+
+        counts = numpy.bincount(positions, minlength=len(ids))
+        nonzero_counts = numpy.bincount(positions, weights=nonzero, minlength=len(ids))
+
+        if self.second_moments:
+            grouped = units[numpy.argsort(positions, kind='stable')]
+            starts = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+        for index, cluster_id in enumerate(ids.tolist()):
+            self._apply(
+                cluster_id, sign, int(counts[index]), sums[index], int(nonzero_counts[index]),
+                grouped[starts[index]:starts[index + 1]] if self.second_moments else None
+            )
+
+    def _apply(self, cluster_id: int, sign: int, count: int, total: numpy.ndarray, nonzero: int,
+               units: Optional[numpy.ndarray]) -> None:
+
+        remaining = self.counts.get(cluster_id, 0) + sign * count
+
+        if remaining <= 0:
+            self.counts.pop(cluster_id, None)
+            self.sums.pop(cluster_id, None)
+            self.nonzero.pop(cluster_id, None)
+            self.moments.pop(cluster_id, None)
+            return
+
+        if cluster_id not in self.sums:
+            self.sums[cluster_id] = numpy.zeros(len(total))
+            self.nonzero[cluster_id] = 0
+
+            if self.second_moments:
+                self.moments[cluster_id] = numpy.zeros((len(total), len(total)))
+
+        self.counts[cluster_id] = remaining
+        self.sums[cluster_id] += sign * total
+        self.nonzero[cluster_id] += sign * nonzero
+
+        if units is not None:
+            self.moments[cluster_id] += sign * (units.T @ units)
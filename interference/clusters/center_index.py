@@ -0,0 +1,188 @@
+from abc import abstractmethod
+from typing import Any, Dict, Optional, TYPE_CHECKING
+from typing_extensions import Protocol
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+if TYPE_CHECKING:
+    from interference.clusters.ecm import ECM
+
+
+class CenterIndex(Protocol):
+    """
+    A spatial index over the centers of an `ECM`. It only narrows down which
+    rows have to be looked at; ECM still computes the exact distances for
+    those rows, so the search decisions are the same as a full scan.
+    """
+
+    @abstractmethod
+    def attach(self, ecm: "ECM") -> None:...
+
+    @abstractmethod
+    def mark_dirty(self, cluster_id: int) -> None:
+        """
+        Called after the row of a created or moved cluster is written.
+        """
+
+    @abstractmethod
+    def mark_removed(self, cluster_id: int) -> None:
+        """
+        Called before the row of a removed cluster is freed, which moves the
+        last row into it.
+        """
+
+    @abstractmethod
+    def rows_within(self, embedding: np.ndarray, radius: float) -> np.ndarray:...
+
+    @abstractmethod
+    def nearest_rows(self, embedding: np.ndarray, k: int) -> np.ndarray:...
+
+    @abstractmethod
+    def describe(self) -> Dict[str, Any]:...
+
+
+class KDTreeCenterIndex(CenterIndex):
+    """
+    A KD-tree over a snapshot of the centers. Clusters created, moved or
+    removed after the snapshot are tracked as dirty and always returned as
+    candidates; the tree is rebuilt once they grow past `rebuild_ratio` of
+    the clusters in the snapshot (and at least `min_dirty`), so every
+    rebuild is paid for by a proportional number of changes.
+
+    Like any KD-tree it pays off for low-dimensional embeddings and many
+    clusters; in high dimensions a full scan is usually faster.
+    """
+
+    # Widens ball queries so that rounding differences between the tree and
+    # cdist can never drop a center sitting exactly on the boundary.
+    RADIUS_SLACK = 1e-9
+
+    def __init__(self, rebuild_ratio: float = 0.05, min_dirty: int = 64, leafsize: int = 16) -> None:
+        self.rebuild_ratio = rebuild_ratio
+        self.min_dirty = min_dirty
+        self.leafsize = leafsize
+
+        self.ecm: Optional["ECM"] = None
+        self.tree: Optional[cKDTree] = None
+
+        # The tree holds the centers of rows 0..len(stale) - 1 as they were
+        # at the snapshot. Any change to a row marks it stale, so the rows
+        # that are not stale still hold the center the tree has for them.
+        self.stale = np.empty(0, dtype=bool)
+
+        # Dirty clusters, and their current rows in the first `dirty_count`
+        # entries of `dirty_rows`, in no particular order.
+        self.dirty: Dict[int, None] = {}
+        self.dirty_rows = np.empty(64, dtype=np.int64)
+        self.dirty_count = 0
+
+    def attach(self, ecm: "ECM") -> None:
+        self.ecm = ecm
+        self._rebuild()
+
+    def mark_dirty(self, cluster_id: int) -> None:
+        assert self.ecm is not None
+
+        if cluster_id in self.dirty:
+            return
+
+        row = self.ecm.row_index[cluster_id]
+
+        self._mark_stale(row)
+        self._add_dirty(cluster_id, row)
+
+    def mark_removed(self, cluster_id: int) -> None:
+        assert self.ecm is not None
+
+        row = self.ecm.row_index[cluster_id]
+        last_row = len(self.ecm.row_index) - 1
+        last_cluster_id = self.ecm.row_index.keys[last_row]
+
+        self._mark_stale(row)
+        self._mark_stale(last_row)
+
+        # Drop both rows, then the last cluster comes back dirty in `row`.
+        rows = self.dirty_rows[:self.dirty_count]
+        kept = rows[(rows != row) & (rows != last_row)]
+
+        self.dirty_rows[:len(kept)] = kept
+        self.dirty_count = len(kept)
+        self.dirty.pop(cluster_id, None)
+        self.dirty.pop(last_cluster_id, None)
+
+        if last_cluster_id != cluster_id:
+            self._add_dirty(last_cluster_id, row)
+
+    def rows_within(self, embedding: np.ndarray, radius: float) -> np.ndarray:
+        self._ensure_fresh()
+
+        if self.tree is None:
+            return self._with_dirty_rows(np.empty(0, dtype=np.int64))
+
+        radius = radius * (1 + self.RADIUS_SLACK) + self.RADIUS_SLACK
+        positions = np.asarray(self.tree.query_ball_point(embedding, radius), dtype=np.int64)
+
+        return self._with_dirty_rows(positions)
+
+    def nearest_rows(self, embedding: np.ndarray, k: int) -> np.ndarray:
+        self._ensure_fresh()
+
+        if self.tree is None:
+            return self._with_dirty_rows(np.empty(0, dtype=np.int64))
+
+        k = min(k, self.tree.n)
+        _, positions = self.tree.query(embedding, k=k)
+
+        return self._with_dirty_rows(np.atleast_1d(positions))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": "KDTree",
+            "parameters": {
+                "rebuild_ratio": self.rebuild_ratio,
+                "min_dirty": self.min_dirty,
+                "leafsize": self.leafsize
+            }
+        }
+
+    def _mark_stale(self, row: int) -> None:
+        if row < len(self.stale):
+            self.stale[row] = True
+
+    def _add_dirty(self, cluster_id: int, row: int) -> None:
+        self.dirty[cluster_id] = None
+
+        if self.dirty_count == len(self.dirty_rows):
+            self.dirty_rows = np.concatenate([self.dirty_rows, np.empty_like(self.dirty_rows)])
+
+        self.dirty_rows[self.dirty_count] = row
+        self.dirty_count += 1
+
+    def _with_dirty_rows(self, positions: np.ndarray) -> np.ndarray:
+        """
+        The rows at `positions` in the tree that are not stale, plus the
+        rows of every dirty cluster, sorted.
+        """
+
+        # A position is the row its center was snapshotted from.
+        rows = positions[~self.stale[positions]]
+
+        # Clean and dirty rows never overlap, so sorting is enough.
+        return np.sort(np.concatenate([rows, self.dirty_rows[:self.dirty_count]]))
+
+    def _ensure_fresh(self) -> None:
+        if len(self.dirty) > max(self.min_dirty, self.rebuild_ratio * len(self.stale)):
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        assert self.ecm is not None
+
+        clusters = len(self.ecm.row_index)
+
+        self.tree = cKDTree(self.ecm._active_centers(), leafsize=self.leafsize, copy_data=True) if clusters > 0 else None
+        self.stale = np.zeros(clusters, dtype=bool)
+
+        self.dirty = {}
+        self.dirty_count = 0
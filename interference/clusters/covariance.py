@@ -1,106 +1,296 @@
 from interference.clusters.processor import Processor
+from interference.util.persistence import load_state, save_state, split_by_counts, tags_to_array
+from interference.util.rows import RowIndex
 import numpy as np
-from typing import Any, Dict, Sequence, Tuple
+from typing import Any, Dict, Optional, Sequence, Tuple
 from scipy.spatial.distance import mahalanobis
+from scipy.stats import chi2
 
 class ClusterNode:
-
-    def __init__(self, id, embedding: np.ndarray, initial_std: float, dimensions: int) -> None:
+    """
+    Keeps the count, mean and sum of squared deviations (M2) of its
+    embeddings with Welford's updates, so adding or removing one embedding
+    costs O(d^2) regardless of the cluster size. The raw embeddings are only
+    kept, in `instances`, when `keep_observations` is set.
+
+    Distances use `precision`, the inverse of the covariance shrunk towards
+    an isotropic prior whose std vector has norm `initial_std`, weighing
+    `regularization` observations:
+    (M2 + regularization * initial_std^2 / d * I) / (n - 1 + regularization).
+    A new cluster is that prior, and its own spread takes over as it grows.
+    `precision` is that of the spread of a new embedding around the mean.
+    The inverse of the regularised scatter is kept up to date with
+    Sherman-Morrison rank-1 updates and recomputed from scratch every
+    `RESYNC_EVERY` changes. `cov_matrix`, `precision` and `std` are
+    derived from those on demand rather than stored.
+    """
+
+    RESYNC_EVERY = 256
+
+    def __init__(self, id, tag: str, embedding: np.ndarray, initial_std: float, dimensions: int,
+                 keep_observations: bool, regularization: float) -> None:
 
         self.id = id
         self.dimensions = dimensions
+        self.initial_std = initial_std
+        self.regularization = regularization
+
+        self.n = 1
+        self.mean = np.array(embedding, dtype=np.float64)
+        self.m2 = np.zeros((dimensions, dimensions))
+
+        self.inverse = np.eye(dimensions) / self.prior_scatter
+        self.changes = 0
+
+        self.instances: Optional[Dict[str, np.ndarray]] = { tag: embedding } if keep_observations else None
+
+    @property
+    def prior_scatter(self) -> float:
+
+        return self.regularization * self.initial_std ** 2 / self.dimensions
+
+    @property
+    def observations(self) -> Optional[np.ndarray]:
+
+        if self.instances is None:
+            return None
 
-        self.cov_matrix = np.eye(dimensions)
-        self.std = initial_std
-        self.mean = embedding
-        self.instances = [embedding]
+        return np.array(list(self.instances.values())).reshape(-1, self.dimensions).T
 
-        i_observation = embedding.reshape((dimensions, 1))
+    def add_embedding(self, tag: str, embedding: np.ndarray) -> None:
 
-        self.observations = i_observation
+        if self.instances is not None:
+            self.instances[tag] = embedding
 
-    def add_embedding(self, embedding) -> None:
+        self.n += 1
+
+        delta = embedding - self.mean
+        self.mean += delta / self.n
+        self.m2 += np.outer(delta, embedding - self.mean)
+
+        # The same change as a symmetric rank-1 term u u^T.
+        self._update_inverse(delta * np.sqrt((self.n - 1) / self.n), 1)
+
+    def remove_embedding(self, tag: str, embedding: np.ndarray) -> None:
+
+        if self.instances is not None:
+            del self.instances[tag]
+
+        self.n -= 1
+
+        if self.n == 0:
+            self.mean = np.zeros(self.dimensions)
+            self.m2 = np.zeros((self.dimensions, self.dimensions))
+            self.resync()
+
+        else:
+            # The inverse of `add_embedding`.
+            delta = embedding - self.mean
+            self.mean -= delta / self.n
+            self.m2 -= np.outer(embedding - self.mean, delta)
 
-        self.instances.append(embedding)
+            self._update_inverse(delta * np.sqrt((self.n + 1) / self.n), -1)
 
-        self.observations = np.hstack([self.observations, embedding.reshape((self.dimensions, 1))])
+    def resync(self) -> None:
 
-        self.cov_matrix = np.cov(self.observations)
+        self.inverse = np.linalg.inv(self.m2 + self.prior_scatter * np.eye(self.dimensions))
+        self.changes = 0
 
-        self.mean = np.mean(self.instances, axis=0)
+    def _update_inverse(self, u: np.ndarray, sign: int) -> None:
 
-        std_vector = np.std(self.instances, axis=0)
+        self.changes += 1
 
-        self.std = np.linalg.norm(std_vector)
+        projected = self.inverse @ u
+        denominator = 1 + sign * (u @ projected)
+
+        if self.changes >= self.RESYNC_EVERY or denominator <= 1e-12:
+            self.resync()
+            return
+
+        self.inverse -= sign * np.outer(projected, projected) / denominator
+
+    @property
+    def cov_matrix(self) -> np.ndarray:
+
+        return (self.m2 + self.prior_scatter * np.eye(self.dimensions)) / (self.n - 1 + self.regularization)
+
+    @property
+    def precision(self) -> np.ndarray:
+
+        # The mean is itself estimated from n embeddings, so a new embedding
+        # is spread around it by (1 + 1/n) times the covariance.
+        return self.n / (self.n + 1) * (self.n - 1 + self.regularization) * self.inverse
+
+    @property
+    def std(self) -> float:
+
+        # The norm of np.std over the embeddings.
+        return float(np.linalg.norm(np.sqrt(np.clip(np.diag(self.m2), 0, None) / self.n)))
 
 
 class CovarianceCluster(Processor):
 
-    def __init__(self, dimensions: int, initial_std: float = 0.01) -> None:
+    def __init__(self, dimensions: int, initial_std: float = 0.01, keep_observations: bool = False,
+                 regularization: Optional[float] = None, prefilter: Optional[int] = None,
+                 max_distance: Optional[float] = None) -> None:
+
+        regularization = regularization if regularization is not None else self.default_regularization(dimensions)
+
+        if initial_std <= 0 or regularization <= 0:
+            raise ValueError("initial_std and regularization must be positive.")
 
         self.initial_std = initial_std
+        # An embedding joins its closest cluster when it is within this
+        # Mahalanobis distance of it.
+        self.max_distance = max_distance if max_distance is not None else self.default_max_distance(dimensions)
+        self.keep_observations = keep_observations
+        self.regularization = regularization
+        # When set, only the `prefilter` clusters with the closest means are
+        # compared by Mahalanobis distance.
+        self.prefilter = prefilter
         self.tag_to_cluster: Dict[str, int] = {}
+        self.cluster_to_tags: Dict[int, Dict[str, None]] = {}
+        # Needed to take an embedding back out of its cluster's statistics.
+        self.tag_to_embedding: Dict[str, np.ndarray] = {}
         self.id = 0
         self.clusters: Dict[int, ClusterNode] = {}
         self.dimensions = dimensions
 
+        # Row i of means/precisions holds cluster row_index.keys[i]. Rows are
+        # patched in place and removed by swapping in the last row. The
+        # precisions are only kept here, not on the nodes.
+        self.means = np.empty((0, dimensions))
+        self.precisions = np.empty((0, dimensions, dimensions))
+        self.row_index: RowIndex[int] = RowIndex()
+
+    @staticmethod
+    def default_regularization(dimensions: int) -> float:
+
+        # The prior weighs as much as the d + 1 observations it takes for a
+        # cluster's own covariance to have full rank.
+        return dimensions + 1.0
+
+    @staticmethod
+    def default_max_distance(dimensions: int) -> float:
+
+        # The distance within which 99.99% of a cluster's own Gaussian
+        # embeddings fall.
+        return float(np.sqrt(chi2.ppf(0.9999, dimensions)))
+
     def add_to_cluster(self, tag: str, embedding: np.ndarray) -> None:
 
+        if tag in self.tag_to_cluster:
+            self.remove_from_cluster(tag)
+
         id = -1
 
         if len(self.clusters) == 0:
 
-            id = self._create_node(embedding)
+            id = self._create_node(tag, embedding)
 
         else:
 
             distance, node = self.brute_search(embedding)
 
-            if distance < node.std:
+            if distance < self.max_distance:
 
-                node.add_embedding(embedding)
+                node.add_embedding(tag, embedding)
+                self._update_row(node)
                 id = node.id
 
             else:
 
-                id = self._create_node(embedding)
+                id = self._create_node(tag, embedding)
 
         self.tag_to_cluster[tag] = id
+        self.cluster_to_tags[id][tag] = None
+        self.tag_to_embedding[tag] = embedding
 
     def remove_from_cluster(self, tag: str) -> None:
-        
-        pass
+
+        id = self.tag_to_cluster.pop(tag)
+        embedding = self.tag_to_embedding.pop(tag)
+
+        del self.cluster_to_tags[id][tag]
+
+        node = self.clusters[id]
+        node.remove_embedding(tag, embedding)
+
+        if node.n == 0:
+            del self.clusters[id]
+            del self.cluster_to_tags[id]
+            self._remove_row(id)
+
+        else:
+            self._update_row(node)
+
+    def _insert_row(self, node: ClusterNode) -> None:
+
+        row = len(self.row_index)
+
+        if row == len(self.means):
+            capacity = max(1, 2 * row)
+
+            self.means = np.concatenate([self.means, np.empty((capacity - row, self.dimensions))])
+            self.precisions = np.concatenate([
+                self.precisions, np.empty((capacity - row, self.dimensions, self.dimensions))])
+
+        self.row_index.append(node.id)
+        self._update_row(node)
+
+    def _update_row(self, node: ClusterNode) -> None:
+
+        row = self.row_index[node.id]
+        self.means[row] = node.mean
+        self.precisions[row] = node.precision
+
+    def _remove_row(self, cluster_id: int) -> None:
+
+        self.row_index.remove(cluster_id, (self.means, self.precisions))
 
     def stat_distance(self, embedding: np.ndarray, node: ClusterNode) -> float:
 
-        return mahalanobis(embedding, node.mean, node.cov_matrix)
+        return mahalanobis(embedding, node.mean, self.precisions[self.row_index[node.id]])
 
-    def brute_search(self, embedding: np.ndarray) -> Tuple[float, ClusterNode]:
+    def stat_distances(self, embedding: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The rows searched, sorted, and the `stat_distance` to each of their
+        clusters, computed in one batched pass over the stacked parameters.
+        """
 
-        nodes = list(self.clusters.values())
+        clusters = len(self.row_index)
+        means = self.means[:clusters]
+
+        if self.prefilter is not None and self.prefilter < clusters:
+            squared = np.einsum('kd,kd->k', means - embedding, means - embedding)
+            rows = np.sort(np.argpartition(squared, self.prefilter - 1)[:self.prefilter])
 
-        curr_node = nodes[0]
-        distance = self.stat_distance(embedding, nodes[0])
+        else:
+            rows = np.arange(clusters)
 
-        for node in nodes[1:]:
+        differences = embedding - means[rows]
+        squared = np.einsum('kd,kde,ke->k', differences, self.precisions[rows], differences)
 
-            c_distance = self.stat_distance(embedding, node)
+        return rows, np.sqrt(np.clip(squared, 0, None))
 
-            if c_distance < distance:
+    def brute_search(self, embedding: np.ndarray) -> Tuple[float, ClusterNode]:
 
-                distance = c_distance
-                curr_node = node
+        rows, distances = self.stat_distances(embedding)
+        position = int(np.argmin(distances))
 
-        return (distance, curr_node)
+        return (float(distances[position]), self.clusters[self.row_index.keys[rows[position]]])
 
-    def _create_node(self, embedding: np.ndarray) -> int:
+    def _create_node(self, tag: str, embedding: np.ndarray) -> int:
 
         id = self.id
         self.id += 1
 
-        new_node = ClusterNode(id, embedding, self.initial_std, self.dimensions)
+        new_node = ClusterNode(id, tag, embedding, self.initial_std, self.dimensions,
+                               self.keep_observations, self.regularization)
 
         self.clusters[id] = new_node
+        self.cluster_to_tags[id] = {}
+        self._insert_row(new_node)
 
         return id
 
@@ -124,8 +314,7 @@ class CovarianceCluster(Processor):
 
     def get_tags_in_cluster(self, cluster_id: int) -> Sequence[str]:
 
-        return [tag for tag, id in self.tag_to_cluster.items() if id ==
-                cluster_id]
+        return list(self.cluster_to_tags.get(cluster_id, ()))
 
     def get_cluster_ids(self) -> Sequence[int]:
         
@@ -134,19 +323,105 @@ class CovarianceCluster(Processor):
             in self.clusters.keys()
         ]
 
+    def get_cluster_sizes(self) -> Dict[int, int]:
+
+        return {id: len(self.cluster_to_tags[id]) for id in self.clusters.keys()}
+
     def predict(self, embedding: np.ndarray) -> int:
 
         return self.brute_search(embedding)[1].id
 
+    def predict_top_n(self, embedding: np.ndarray, n: int) -> Sequence[int]:
+
+        rows, distances = self.stat_distances(embedding)
+
+        return [self.row_index.keys[rows[position]] for position in np.argsort(distances, kind='stable')[:max(1, n)]]
+
     def describe(self) -> Dict[str, Any]:
 
         return {
             "name": "Covariance Cluster",
             "parameters": {
-                "initial_std": self.initial_std
+                "initial_std": self.initial_std,
+                "regularization": self.regularization,
+                "max_distance": self.max_distance,
+                "prefilter": self.prefilter,
+                **({"keep_observations": True} if self.keep_observations else {})
             }
         }
 
     def safe_file_name(self) -> str:
 
-        return f"CovCluster = initial_std={self.initial_std}"
\ No newline at end of file
+        # Parameters left at their defaults keep the names of earlier results.
+        name = f"CovCluster = initial_std={self.initial_std}"
+
+        if self.regularization != self.default_regularization(self.dimensions):
+            name += f";regularization={self.regularization}"
+
+        if self.max_distance != self.default_max_distance(self.dimensions):
+            name += f";max_distance={self.max_distance}"
+
+        if self.prefilter is not None:
+            name += f";prefilter={self.prefilter}"
+
+        return name
+
+    def save(self, path: str) -> None:
+
+        nodes = list(self.clusters.values())
+        tags = [tag for node in nodes for tag in self.cluster_to_tags[node.id]]
+
+        save_state(path, "CovarianceCluster", {
+            "dimensions": self.dimensions,
+            "initial_std": self.initial_std,
+            "keep_observations": self.keep_observations,
+            "regularization": self.regularization,
+            "prefilter": self.prefilter,
+            "max_distance": self.max_distance,
+            "id": self.id
+        }, {
+            "ids": np.array([node.id for node in nodes], dtype=np.int64),
+            "row_to_cluster": np.array(self.row_index.keys, dtype=np.int64),
+            "counts": np.array([node.n for node in nodes], dtype=np.int64),
+            "means": np.array([node.mean for node in nodes]).reshape(len(nodes), self.dimensions),
+            "m2s": np.array([node.m2 for node in nodes]).reshape(len(nodes), self.dimensions, self.dimensions),
+            "tags": tags_to_array(tags),
+            "embeddings": np.array([self.tag_to_embedding[tag] for tag in tags]).reshape(len(tags), self.dimensions)
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "CovarianceCluster":
+
+        parameters, arrays = load_state(path, "CovarianceCluster")
+
+        cluster = cls(parameters["dimensions"], parameters["initial_std"], parameters["keep_observations"],
+                      parameters["regularization"], parameters["prefilter"], parameters["max_distance"])
+        cluster.id = parameters["id"]
+
+        tags = split_by_counts(arrays["tags"].tolist(), arrays["counts"])
+        embeddings = split_by_counts(np.array(arrays["embeddings"]), arrays["counts"])
+
+        for position, id in enumerate(arrays["ids"].tolist()):
+
+            node = ClusterNode(id, tags[position][0], embeddings[position][0], cluster.initial_std,
+                               cluster.dimensions, cluster.keep_observations, cluster.regularization)
+
+            node.n = len(tags[position])
+            node.mean = np.array(arrays["means"][position])
+            node.m2 = np.array(arrays["m2s"][position])
+            node.resync()
+
+            if node.instances is not None:
+                node.instances = dict(zip(tags[position], embeddings[position]))
+
+            cluster.clusters[id] = node
+            cluster.cluster_to_tags[id] = dict.fromkeys(tags[position])
+
+            for tag, embedding in zip(tags[position], embeddings[position]):
+                cluster.tag_to_cluster[tag] = id
+                cluster.tag_to_embedding[tag] = embedding
+
+        for id in arrays["row_to_cluster"].tolist():
+            cluster._insert_row(cluster.clusters[id])
+
+        return cluster
@@ -1,5 +1,8 @@
+from interference.clusters.center_index import CenterIndex
 from interference.clusters.processor import Processor
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+from interference.util.persistence import load_state, save_state, saved_type, split_by_counts, tags_to_array, type_name
+from interference.util.rows import RowIndex
+from typing import Any, Dict, Optional, Sequence, Tuple
 
 import numpy
 
@@ -14,11 +17,12 @@ class Cluster:
     def __init__(self, tag: str, center: numpy.ndarray, index: int) -> None:
         self.center = center
         self.radius = 0
-        self.tags = [tag]
+        # Insertion-ordered set of the member tags, for O(1) removal.
+        self.tags: Dict[str, None] = {tag: None}
         self.index = index
 
     def add_radius(self, tag: str, embedding: numpy.ndarray) -> None:
-        self.tags.append(tag)
+        self.tags[tag] = None
 
     def _adapt(self, distance: float, embedding: numpy.ndarray):
         direction = embedding - self.center
@@ -37,7 +41,7 @@ class Cluster:
         self._adapt(distance, embedding)
 
     def remove(self, tag: str) -> None:
-        self.tags.remove(tag)
+        del self.tags[tag]
 
 
 class SearchResultType(Enum):
@@ -48,18 +52,30 @@ class SearchResultType(Enum):
 
 class ECM(Processor):
 
-    def __init__(self, distance_threshold: float) -> None:
+    def __init__(self, distance_threshold: float, center_index: Optional[CenterIndex] = None) -> None:
         self.clusters: Dict[int, Cluster] = {}
         self.distance_threshold = distance_threshold
         self.tag_to_cluster: Dict[str, int] = {}
         self.cluster_index = 0
 
-        self.cached_cluster_keys: List[int] = []
-        self.cached_cluster_centers: List[numpy.ndarray] = []
-        self.cached_cluster_radiuses: List[float] = []
+        # Row i of centers/radiuses holds cluster row_index.keys[i]. Rows are
+        # patched in place and removed by swapping in the last row.
+        self.centers: Optional[numpy.ndarray] = None
+        self.radiuses: numpy.ndarray = np.empty(0)
+        self.row_index: RowIndex[int] = RowIndex()
+        # The largest radius, kept up to date with the rows. Radiuses only
+        # grow while their cluster exists, so it is only recomputed when the
+        # cluster holding it is removed.
+        self.max_radius = 0.0
+
+        # Optional spatial index that narrows down the rows searched.
+        self.center_index = center_index
+
+        if center_index is not None:
+            center_index.attach(self)
 
     def update(self, tag: str, embedding: numpy.ndarray) -> None:
-        result, (searched_index, searched_distance) = self._search_index_and_distance(embedding)
+        result, (searched_index, searched_distance) = self._search_index_and_distance(embedding, nearest_outside=False)
         old_index = self.get_cluster_by_tag(tag)
         old_cluster = self.clusters[old_index]
 
@@ -86,6 +102,7 @@ class ECM(Processor):
         else:
             if searched_index == old_index:
                 old_cluster.update_threshold(searched_distance, tag, embedding)
+                self._update_row(old_cluster)
 
                 index = searched_index
             else:
@@ -93,23 +110,63 @@ class ECM(Processor):
 
                 new_cluster = self.clusters[searched_index]
                 new_cluster.add_threshold(searched_distance, tag, embedding)
+                self._update_row(new_cluster)
 
                 index = searched_index
 
         self.tag_to_cluster[tag] = index
-        self._invalidate_cached()
 
     def _remove_from_cluster(self, cluster: Cluster, tag: str) -> None:
         cluster.remove(tag)
         if len(cluster.tags) == 0:
             del self.clusters[cluster.index]
+            self._remove_row(cluster.index)
 
     def _create_cluster(self, tag: str, embedding: numpy.ndarray) -> Cluster:
         cluster = Cluster(tag, embedding, self.cluster_index)
         self.clusters[self.cluster_index] = cluster
         self.cluster_index += 1
+        self._insert_row(cluster)
         return cluster
 
+    def _insert_row(self, cluster: Cluster) -> None:
+        row = len(self.row_index)
+
+        if self.centers is None:
+            self.centers = np.empty((16, len(cluster.center)))
+            self.radiuses = np.empty(16)
+
+        elif row == len(self.centers):
+            self.centers = np.concatenate([self.centers, np.empty_like(self.centers)])
+            self.radiuses = np.concatenate([self.radiuses, np.empty_like(self.radiuses)])
+
+        self.row_index.append(cluster.index)
+        self._update_row(cluster)
+
+    def _update_row(self, cluster: Cluster) -> None:
+        assert self.centers is not None
+
+        row = self.row_index[cluster.index]
+        self.centers[row] = cluster.center
+        self.radiuses[row] = cluster.radius
+        self.max_radius = max(self.max_radius, cluster.radius)
+
+        if self.center_index is not None:
+            self.center_index.mark_dirty(cluster.index)
+
+    def _remove_row(self, cluster_id: int) -> None:
+        assert self.centers is not None
+
+        if self.center_index is not None:
+            self.center_index.mark_removed(cluster_id)
+
+        radius = self.radiuses[self.row_index[cluster_id]]
+
+        self.row_index.remove(cluster_id, (self.centers, self.radiuses))
+
+        if radius >= self.max_radius:
+            self.max_radius = float(self._active_radiuses().max(initial=0.0))
+
     def remove(self, tag: str) -> None:
         index = self.get_cluster_by_tag(tag)
         cluster = self.clusters[index]
@@ -117,67 +174,137 @@ class ECM(Processor):
         del self.tag_to_cluster[tag]
 
         self._remove_from_cluster(cluster, tag)
-        self._invalidate_cached()
 
     def get_cluster_by_tag(self, tag: str) -> int:
         return self.tag_to_cluster[tag]
 
     def get_tags_in_cluster(self, cluster_id: int) -> Sequence[str]:
-        return self.clusters[cluster_id].tags
+        return list(self.clusters[cluster_id].tags)
 
     def get_cluster_ids(self) -> Sequence[int]:
         return list(self.clusters.keys())
 
+    def get_cluster_sizes(self) -> Dict[int, int]:
+        return {cluster_id: len(cluster.tags) for cluster_id, cluster in self.clusters.items()}
+
     def process(self, tag: str, embedding: numpy.ndarray) -> None:
         if len(self.clusters) == 0:
             cluster = self._create_cluster(tag, embedding)
 
         else:
-            search_result, (index, distance) = self._search_index_and_distance(embedding)
+            search_result, (index, distance) = self._search_index_and_distance(embedding, nearest_outside=False)
+            cluster = self._add_with_search_result(tag, embedding, search_result, index, distance)
 
-            if search_result == SearchResultType.RADIUS:
-                cluster = self.clusters[index]
-                cluster.add_radius(tag, embedding)
+        self.tag_to_cluster[tag] = cluster.index
 
-            elif search_result == SearchResultType.THRESHOLD:
-                cluster = self.clusters[index]
-                cluster.add_threshold(distance, tag, embedding)
+    def _add_with_search_result(self, tag: str, embedding: numpy.ndarray,
+                                search_result: SearchResultType, index: int, distance: float) -> Cluster:
 
-            # search_result == SearchResultType.OUTSIDE
-            else:
-                cluster = self._create_cluster(tag, embedding)
+        if search_result == SearchResultType.RADIUS:
+            cluster = self.clusters[index]
+            cluster.add_radius(tag, embedding)
 
-        self.tag_to_cluster[tag] = cluster.index
-        self._invalidate_cached()
+        elif search_result == SearchResultType.THRESHOLD:
+            cluster = self.clusters[index]
+            cluster.add_threshold(distance, tag, embedding)
+            self._update_row(cluster)
 
-    def _invalidate_cached(self):
-        self.cached_cluster_keys = []
-        self.cached_cluster_centers = []
-        self.cached_cluster_radiuses = []
+        # search_result == SearchResultType.OUTSIDE
+        else:
+            cluster = self._create_cluster(tag, embedding)
 
-    def _ensure_cached(self):
-        if not self.cached_cluster_keys and len(self.clusters) > 0:
-            self.cached_cluster_keys = []
-            self.cached_cluster_centers = []
-            self.cached_cluster_radiuses = []
-            for index, cluster in self.clusters.items():
-                self.cached_cluster_keys.append(index)
-                self.cached_cluster_centers.append(cluster.center)
-                self.cached_cluster_radiuses.append(cluster.radius)
+        return cluster
 
+    def _active_centers(self) -> numpy.ndarray:
+        assert self.centers is not None
+        return self.centers[:len(self.row_index)]
 
-    def _search_index_and_distance(self, embedding: numpy.ndarray) -> \
-            Tuple[SearchResultType, Tuple[int, float]]:
+    def _active_radiuses(self) -> numpy.ndarray:
+        return self.radiuses[:len(self.row_index)]
 
-        self._ensure_cached()
+    def _distances_to_centers(self, embedding: numpy.ndarray) -> numpy.ndarray:
 
-        distances = cdist(
+        return cdist(
             np.array([embedding]),
-            np.array(self.cached_cluster_centers),
+            self._active_centers(),
             'euclidean'
         )[0]
 
-        diffs = distances - self.cached_cluster_radiuses
+    def _search_index_and_distance(self, embedding: numpy.ndarray, nearest_outside: bool = True) -> \
+            Tuple[SearchResultType, Tuple[int, float]]:
+        """
+        With `nearest_outside` unset, an OUTSIDE result may skip looking for
+        the nearest cluster and come back as (-1, inf), for callers that
+        create a new cluster anyway.
+        """
+
+        if self.center_index is not None:
+            return self._search_with_center_index(embedding, nearest_outside)
+
+        return self._search_from_distances(self._distances_to_centers(embedding))
+
+    def _search_with_center_index(self, embedding: numpy.ndarray, nearest_outside: bool) -> \
+            Tuple[SearchResultType, Tuple[int, float]]:
+        """
+        Same decisions as `_search_from_distances` over every center, but only
+        measuring the rows the index returns. Candidate rows come back sorted,
+        so ties are broken in row order exactly like the full scan.
+        """
+
+        assert self.center_index is not None
+
+        centers = self._active_centers()
+        radiuses = self._active_radiuses()
+
+        # Every center containing the sample is within the largest radius,
+        # and every center within 2 * distance_threshold counting its radius
+        # is within that distance, so this finds any RADIUS or THRESHOLD
+        # result in one query.
+        rows = self.center_index.rows_within(embedding, max(self.max_radius, 2 * self.distance_threshold))
+
+        if rows.size > 0:
+            distances = cdist(np.array([embedding]), centers[rows], 'euclidean')[0]
+            search_result, (position, distance) = self._search_from_distances(distances, radiuses[rows])
+
+            if search_result != SearchResultType.OUTSIDE:
+                return search_result, (self.row_index.keys[rows[position]], distance)
+
+        if not nearest_outside:
+            return SearchResultType.OUTSIDE, (-1, np.inf)
+
+        rows = self.center_index.nearest_rows(embedding, 1)
+
+        if rows.size == 0:
+            return self._search_from_distances(self._distances_to_centers(embedding))
+
+        # A center can only beat the lowest distance plus radius seen so far
+        # if it is closer than that value.
+        distances = cdist(np.array([embedding]), centers[rows], 'euclidean')[0]
+        bound = max(self.max_radius, (distances + radiuses[rows]).min())
+
+        rows = self.center_index.rows_within(embedding, bound)
+
+        distances = cdist(np.array([embedding]), centers[rows], 'euclidean')[0]
+        search_result, (position, distance) = self._search_from_distances(distances, radiuses[rows])
+
+        return search_result, (self.row_index.keys[rows[position]], distance)
+
+    def _search_from_distances(self, distances: numpy.ndarray, radiuses: Optional[numpy.ndarray] = None) -> \
+            Tuple[SearchResultType, Tuple[int, float]]:
+        """
+        Searches over every center when `radiuses` is not given, returning a
+        cluster id. Otherwise `distances` and `radiuses` describe a subset of
+        rows and the position in that subset is returned instead.
+        """
+
+        keys: Sequence[int] = self.row_index.keys
+
+        if radiuses is None:
+            radiuses = self._active_radiuses()
+        else:
+            keys = range(len(radiuses))
+
+        diffs = distances - radiuses
 
         possible_indexes = np.where(diffs <= 0)[0]
 
@@ -186,13 +313,13 @@ class ECM(Processor):
         min_index: Optional[int] = None if possible.size == 0 else possible_indexes[possible.argmin()]
 
         if min_index is not None:
-            return SearchResultType.RADIUS, (self.cached_cluster_keys[min_index], distances[min_index])
+            return SearchResultType.RADIUS, (keys[min_index], distances[min_index])
 
-        distances_plus_radiuses = distances + self.cached_cluster_radiuses
+        distances_plus_radiuses = distances + radiuses
         lowest_distance_and_radius_index = np.argmin(distances_plus_radiuses)
         lowest_distance_and_radius: float = distances_plus_radiuses[lowest_distance_and_radius_index]
 
-        actual_index = self.cached_cluster_keys[lowest_distance_and_radius_index]
+        actual_index = keys[lowest_distance_and_radius_index]
 
         if lowest_distance_and_radius > 2 * self.distance_threshold:
             return SearchResultType.OUTSIDE, (actual_index, lowest_distance_and_radius)
@@ -208,13 +335,80 @@ class ECM(Processor):
         return {
             "name": "ECM",
             "parameters": {
-                "distance threshold": self.distance_threshold
+                "distance threshold": self.distance_threshold,
+                "center index": None if self.center_index is None else self.center_index.describe()
             }
         }
 
     def safe_file_name(self) -> str:
         return f"ECM = distance_threshold={self.distance_threshold}"
 
+    def save(self, path: str) -> None:
+        # Everything is stored in row order; `cluster_ids` keeps the order of
+        # `clusters` and the original dtype of each center.
+        clusters = [self.clusters[cluster_id] for cluster_id in self.row_index.keys]
+
+        save_state(path, "ECM", {
+            "distance_threshold": self.distance_threshold,
+            "cluster_index": self.cluster_index,
+            "center_index": None if self.center_index is None else {
+                "type": type_name(type(self.center_index)),
+                **self.center_index.describe()
+            }
+        }, {
+            "cluster_ids": numpy.array(list(self.clusters.keys()), dtype=np.int64),
+            "row_to_cluster": numpy.array(self.row_index.keys, dtype=np.int64),
+            "centers": self._active_centers() if self.centers is not None else np.empty((0, 0)),
+            "center_dtypes": tags_to_array(str(cluster.center.dtype) for cluster in clusters),
+            "radiuses": self._active_radiuses(),
+            "member_counts": numpy.array([len(cluster.tags) for cluster in clusters], dtype=np.int64),
+            "member_tags": tags_to_array(tag for cluster in clusters for tag in cluster.tags)
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "ECM":
+        parameters, arrays = load_state(path, "ECM")
+
+        center_index: Optional[CenterIndex] = None
+        # The index is rebuilt from its described parameters, which name the
+        # arguments of its constructor.
+        if parameters["center_index"] is not None:
+            index_type = saved_type(parameters["center_index"]["type"])
+            center_index = index_type(**parameters["center_index"]["parameters"])
+
+        ecm = cls(parameters["distance_threshold"])
+        ecm.cluster_index = parameters["cluster_index"]
+
+        row_to_cluster = arrays["row_to_cluster"].tolist()
+        members = split_by_counts(arrays["member_tags"].tolist(), arrays["member_counts"])
+
+        clusters: Dict[int, Cluster] = {}
+
+        for row, (cluster_id, dtype, tags) in enumerate(zip(row_to_cluster, arrays["center_dtypes"].tolist(), members)):
+            cluster = Cluster(tags[0], arrays["centers"][row].astype(dtype), cluster_id)
+            cluster.radius = float(arrays["radiuses"][row])
+            cluster.tags = dict.fromkeys(tags)
+
+            clusters[cluster_id] = cluster
+
+            for tag in tags:
+                ecm.tag_to_cluster[tag] = cluster_id
+
+        ecm.clusters = { cluster_id: clusters[cluster_id] for cluster_id in arrays["cluster_ids"].tolist() }
+
+        if len(row_to_cluster) > 0:
+            ecm.centers = np.array(arrays["centers"], dtype=np.float64)
+            ecm.radiuses = np.array(arrays["radiuses"], dtype=np.float64)
+
+        ecm.row_index = RowIndex(row_to_cluster)
+        ecm.max_radius = float(ecm._active_radiuses().max(initial=0.0))
+
+        if center_index is not None:
+            ecm.center_index = center_index
+            center_index.attach(ecm)
+
+        return ecm
+
     def predict(self, embedding: numpy.ndarray) -> int:
         search_result, (index, _) = self._search_index_and_distance(embedding)
 
@@ -227,4 +421,55 @@ class ECM(Processor):
 
         #elif search_result == SearchResultType.RADIUS:
         else:
-            return index
\ No newline at end of file
+            return index
+
+    def predict_many(self, embeddings: numpy.ndarray) -> Sequence[int]:
+        """
+        Same as calling `predict` for each row, with a single `cdist` and the
+        search vectorized over all rows.
+        """
+
+        if self.center_index is not None:
+            return [self.predict(embedding) for embedding in embeddings]
+
+        distances = cdist(
+            np.asarray(embeddings),
+            self._active_centers(),
+            'euclidean'
+        )
+
+        radiuses = self._active_radiuses()
+
+        distances_in_radius = np.where(distances - radiuses <= 0, distances, np.inf)
+        radius_indexes = np.argmin(distances_in_radius, axis=1)
+        has_radius = np.isfinite(distances_in_radius[np.arange(len(distances)), radius_indexes])
+
+        lowest_distance_and_radius_indexes = np.argmin(distances + radiuses, axis=1)
+
+        positions = np.where(has_radius, radius_indexes, lowest_distance_and_radius_indexes)
+
+        return [self.row_index.keys[position] for position in positions]
+
+    def predict_top_n(self, embedding: numpy.ndarray, n: int) -> Sequence[int]:
+        distances = self._distances_to_centers(embedding)
+
+        _, (index, _) = self._search_from_distances(distances)
+
+        if n <= 1:
+            return [index]
+
+        distances_plus_radiuses = distances + self._active_radiuses()
+
+        nearest = [index]
+
+        for position in np.argsort(distances_plus_radiuses, kind='stable'):
+
+            key = self.row_index.keys[position]
+
+            if key != index:
+                nearest.append(key)
+
+            if len(nearest) == n:
+                break
+
+        return nearest
\ No newline at end of file
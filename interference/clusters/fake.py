@@ -1,4 +1,5 @@
 from interference.clusters.processor import Processor
+from interference.util.persistence import load_state, save_state, tags_to_array
 from typing import Any, Dict, List, Set
 
 import numpy
@@ -26,6 +27,9 @@ class Fake(Processor):
     def get_cluster_ids(self) -> List[int]:
         return [1]
 
+    def get_cluster_sizes(self) -> Dict[int, int]:
+        return {1: len(self.tags)}
+
     def process(self, tag: str, instance: numpy.ndarray) -> None:
         self.tags.add(tag)
 
@@ -43,4 +47,19 @@ class Fake(Processor):
         return f"Fake"
 
     def predict(self, instance: Any) -> int:
-        return 1
\ No newline at end of file
+        return 1
+
+    def predict_top_n(self, instance: Any, n: int) -> List[int]:
+        return [1]
+
+    def save(self, path: str) -> None:
+        save_state(path, "Fake", {}, { "tags": tags_to_array(self.tags) })
+
+    @classmethod
+    def load(cls, path: str) -> "Fake":
+        _, arrays = load_state(path, "Fake")
+
+        fake = cls()
+        fake.tags = set(arrays["tags"].tolist())
+
+        return fake
\ No newline at end of file
@@ -1,33 +1,39 @@
 import heapq
+import math
 
-from typing import Any, Sequence, Tuple, Optional, Dict
+from typing import Any, Callable, Sequence, Set, Tuple, Dict
 
 import numpy as np
-import faiss
 
 from scipy.spatial.distance import cdist
 
 from interference.clusters.processor import Processor
+from interference.util.persistence import load_state, save_state, split_by_counts, tags_to_array
+from interference.util.rows import RowIndex
 
 import numpy as np
 
 from typing import List, Dict
 
 class Node:
+    """
+    A node of the graph. Its prototype and radius are a row of the
+    `PrototypeMatrix` and the ages of its links live in the graph's
+    `LinkTable`; `links` maps each neighbour id to the slot of the shared
+    link.
+    """
 
-    def __init__(self, protype, error: float, id: int, error_cycle: int, radius: float) -> None:
+    __slots__ = ("error", "topological_neighbors", "links", "instances", "error_cycle", "id")
+
+    def __init__(self, error: float, id: int, error_cycle: int) -> None:
 
-        self.protype = protype
         self.error = error
         self.topological_neighbors: Dict[int, "Node"] = {}
-        self.instances = []
+        self.links: Dict[int, int] = {}
+        # Insertion-ordered set of the member tags, for O(1) removal.
+        self.instances: Dict[str, None] = {}
         self.error_cycle = error_cycle
         self.id = id
-        self.radius = radius
-
-    def __lt__(self, other: "Node"):
-
-        return self.error > other.error
 
     def add_neighbor(self, neighbor: "Node") -> None:
 
@@ -35,7 +41,7 @@ class Node:
 
     def add_instance(self, instance) -> None:
 
-        self.instances.append(instance)
+        self.instances[instance] = None
 
     def remove_neighbor(self, neighbor: "Node") -> None:
 
@@ -43,37 +49,188 @@ class Node:
 
     def remove_instance(self, instance):
 
-        self.instances.remove(instance)
+        del self.instances[instance]
 
     def update_error_cycle(self, cycle: int) -> None:
 
         self.error_cycle = cycle
 
 
-class Link:
+class LinkTable:
+    """
+    The ages of every link in one integer array. Each link owns a slot;
+    freed slots are reused by the next links.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+
+        self.ages = np.zeros(capacity, dtype=np.int64)
+        self.free: List[int] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+
+        return self.size - len(self.free)
+
+    def allocate(self) -> int:
+
+        if len(self.free) > 0:
+            slot = self.free.pop()
+
+        else:
+            slot = self.size
+            self.size += 1
+
+            if slot == len(self.ages):
+                self.ages = np.concatenate([self.ages, np.zeros_like(self.ages)])
+
+        self.ages[slot] = 0
+
+        return slot
+
+    def release(self, slot: int) -> None:
+
+        self.free.append(slot)
+
+    def restore(self, ages: np.ndarray, free: List[int]) -> None:
+
+        self.ages = np.zeros(max(64, len(ages)), dtype=np.int64)
+        self.ages[:len(ages)] = ages
+        self.size = len(ages)
+        self.free = free
+
+
+class PrototypeMatrix:
+    """
+    Node prototypes as rows of one preallocated float32 matrix, updated in
+    place. Removing a node moves the last row into its slot. Nearest
+    searches scan the used rows with vectorized NumPy, so there is no index
+    to maintain when prototypes move.
+    """
+
+    # Bounds the (queries x rows x dimensions) temporary of batched searches.
+    SEARCH_BLOCK = 1 << 22
+
+    def __init__(self, dimensions: int, capacity: int = 64) -> None:
+
+        self.dimensions = dimensions
+        self.matrix = np.empty((capacity, dimensions), dtype='float32')
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.radiuses = np.empty(capacity, dtype=np.float64)
+        # `ids` mirrors `row_index.keys` as an array, for vectorized lookups.
+        self.row_index: RowIndex[int] = RowIndex()
+
+    def __len__(self) -> int:
+
+        return len(self.row_index)
 
-    def __init__(self, v: Node, u: Node) -> None:
+    @classmethod
+    def from_arrays(cls, ids: np.ndarray, matrix: np.ndarray, radiuses: np.ndarray) -> "PrototypeMatrix":
 
-        self.age = 0
-        self.v = v
-        self.u = u
+        prototypes = cls(matrix.shape[1], capacity=max(64, len(ids)))
 
-    def fade(self) -> None:
+        prototypes.matrix[:len(ids)] = matrix
+        prototypes.ids[:len(ids)] = ids
+        prototypes.radiuses[:len(ids)] = radiuses
+        prototypes.row_index = RowIndex(ids.tolist())
 
-        self.age += 1
+        return prototypes
 
-    def renew(self) -> None:
+    def add(self, id: int, prototype: np.ndarray, radius: float) -> None:
 
-        self.age = 0
+        row = len(self.row_index)
+
+        if row == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+            self.ids = np.concatenate([self.ids, np.empty_like(self.ids)])
+            self.radiuses = np.concatenate([self.radiuses, np.empty_like(self.radiuses)])
+
+        self.row_index.append(id)
+        self.ids[row] = id
+        self.radiuses[row] = radius
+        self.matrix[row] = prototype
+
+    def get(self, id: int) -> np.ndarray:
+        """
+        The prototype of `id` as a view, to be read or updated in place. It
+        is invalidated by the next `add` or `remove`.
+        """
+
+        return self.matrix[self.row_index[id]]
+
+    def radius(self, id: int) -> float:
+
+        return float(self.radiuses[self.row_index[id]])
+
+    def get_rows(self, ids: Sequence[int]) -> np.ndarray:
+
+        return self.row_index.get_rows(ids)
+
+    def remove(self, id: int) -> None:
+
+        self.row_index.remove(id, (self.matrix, self.ids, self.radiuses))
+
+    def nearest(self, instances: np.ndarray, k: int, expanded: bool = False) -> np.ndarray:
+        """
+        The ids of the `k` nearest prototypes to each row of `instances`,
+        closest first, as a (len(instances), min(k, len(self))) array.
+
+        With `expanded`, batched distances are computed as
+        |x|^2 - 2 x.p + |p|^2 with one matrix product. That is much faster for
+        big batches but can order near ties differently than the exact path.
+        """
+
+        instances = np.asarray(instances, dtype='float32').reshape(-1, self.dimensions)
+        prototypes = self.matrix[:len(self.row_index)]
+        k = min(k, len(prototypes))
+
+        if expanded and len(instances) > 1:
+            distances = (
+                np.einsum('qd,qd->q', instances, instances)[:, None]
+                - 2 * instances @ prototypes.T
+                + np.einsum('nd,nd->n', prototypes, prototypes)[None, :]
+            )
+
+            return self.ids[self._smallest(distances, k)]
+
+        if len(instances) == 1:
+            differences = prototypes - instances[0]
+            distances = np.einsum('nd,nd->n', differences, differences)
+
+            candidates = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(k)
+
+            return self.ids[candidates[np.argsort(distances[candidates], kind='stable')]][None, :]
+
+        block = max(1, self.SEARCH_BLOCK // max(1, prototypes.size))
+        nearest = np.empty((len(instances), k), dtype=np.int64)
+
+        for start in range(0, len(instances), block):
+            differences = instances[start:start + block, None, :] - prototypes[None, :, :]
+            distances = np.einsum('qnd,qnd->qn', differences, differences)
+
+            nearest[start:start + block] = self.ids[self._smallest(distances, k)]
+
+        return nearest
+
+    def _smallest(self, distances: np.ndarray, k: int) -> np.ndarray:
+
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+
+        order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind='stable')
+
+        return np.take_along_axis(candidates, order, axis=1)
 
 
 class GTurbo(Processor):
 
     def __init__(self, epsilon_b: float, epsilon_n: float, lam: int, beta: float,
                  alpha: float, max_age: int, r0: float,
-                 dimensions: int = 2, random_state: int = 42) -> None:
+                 dimensions: int = 2, random_state: int = 42, batch_size: int = 1) -> None:
 
-        self.graph = Graph()
+        self.graph = Graph(self.error_priority)
 
         self.epsilon_b = epsilon_b
         self.epsilon_n = epsilon_n
@@ -83,8 +240,9 @@ class GTurbo(Processor):
         self.max_age = max_age
         self.dimensions = dimensions
         self.r0 = r0
+        self.batch_size = max(1, batch_size)
 
-        self.index = faiss.IndexIDMap(faiss.IndexFlatL2(dimensions))
+        self.prototypes = PrototypeMatrix(dimensions)
 
         self.next_id = 2
         self.point_to_cluster = {}
@@ -92,18 +250,21 @@ class GTurbo(Processor):
         self.cycle = 0
         self.step = 1
 
-        np.random.seed(random_state)
+        # The same draws as seeding the global generator, without touching
+        # it, so building (or loading) a GTurbo leaves callers' RNG alone.
+        random = np.random.RandomState(random_state)
 
-        node_1 = Node(np.random.rand(1, dimensions).astype(
-            'float32')[0], 0, id=0, error_cycle=0, radius=r0)
-        node_2 = Node(np.random.rand(1, dimensions).astype(
-            'float32')[0], 0, id=1, error_cycle=0, radius=r0)
+        prototype_1 = random.rand(1, dimensions).astype('float32')[0]
+        prototype_2 = random.rand(1, dimensions).astype('float32')[0]
+
+        node_1 = Node(0, id=0, error_cycle=0)
+        node_2 = Node(0, id=1, error_cycle=0)
 
         self.graph.insert_node(node_1)
         self.graph.insert_node(node_2)
 
-        self.index.add_with_ids(
-            np.array([node_1.protype, node_2.protype]), np.array([0, 1]))
+        self.prototypes.add(node_1.id, prototype_1, r0)
+        self.prototypes.add(node_2.id, prototype_2, r0)
 
     def turbo_step(self, tag, instance):
 
@@ -121,24 +282,23 @@ class GTurbo(Processor):
 
     def create_node(self, q: Node, f: Node, radius: float) -> Node:
 
-        r = Node(np.array(0.5*(q.protype + f.protype)).astype(
-            'float32'), 0,
-            self.next_id, self.cycle, radius)
+        prototype = np.array(0.5*(self.prototypes.get(q.id) + self.prototypes.get(f.id))).astype('float32')
+
+        r = Node(0, self.next_id, self.cycle)
         self.next_id += 1
 
         self.graph.insert_node(r)
-        self.index.add_with_ids(np.array([r.protype]), np.array([r.id]))
+        self.prototypes.add(r.id, prototype, radius)
 
         return r
 
     def create_node_from_instance(self, instance, radius: float) -> Node:
 
-        r = Node(instance.astype(
-            'float32'), 0, self.next_id, self.cycle, radius)
+        r = Node(0, self.next_id, self.cycle)
         self.next_id += 1
 
         self.graph.insert_node(r)
-        self.index.add_with_ids(np.array([r.protype]), np.array([r.id]))
+        self.prototypes.add(r.id, instance.astype('float32'), radius)
 
         return r
 
@@ -160,13 +320,13 @@ class GTurbo(Processor):
         self.decrease_error(f)
 
         r.error = 0.5*(q.error + f.error)
-        self.graph.update_heap()
+        self.graph.update_priority(r)
 
     def get_best_match(self, instance) -> Tuple[Node, Node]:
 
-        _, I = self.index.search(np.array([instance]).astype('float32'), 2)
+        nearest = self.prototypes.nearest(instance, 2)[0]
 
-        return (self.graph.get_node(I[0][0]), self.graph.get_node(I[0][1]))
+        return (self.graph.get_node(nearest[0]), self.graph.get_node(nearest[1]))
 
     def increment_error(self, node: Node, value: float) -> None:
 
@@ -174,7 +334,7 @@ class GTurbo(Processor):
         node.error = node.error * \
             (np.power(self.beta, self.lam - self.step)) + value
 
-        self.graph.update_heap()
+        self.graph.update_priority(node)
 
     def fix_error(self, node: Node) -> None:
 
@@ -182,13 +342,22 @@ class GTurbo(Processor):
                               (self.cycle - node.error_cycle))*node.error
         node.update_error_cycle(self.cycle)
 
-    def update_prototype(self, v: Node, scale: float, instance) -> None:
+    def error_priority(self, node: Node) -> float:
+        """
+        The node's error decayed back to cycle 0, in log space. `fix_error`
+        leaves it unchanged, so it orders nodes by their current error without
+        having to fix every node first.
+        """
+
+        if node.error <= 0:
+            return -math.inf
 
-        self.index.remove_ids(np.array([v.id]))
+        return math.log(node.error) - self.lam * node.error_cycle * math.log(self.beta)
 
-        v.protype += scale*(instance - v.protype)
+    def update_prototype(self, v: Node, scale: float, instance) -> None:
 
-        self.index.add_with_ids(np.array([v.protype]), np.array([v.id]))
+        prototype = self.prototypes.get(v.id)
+        prototype += scale*(instance - prototype)
 
     def distance(self, u, v) -> float:
 
@@ -198,14 +367,15 @@ class GTurbo(Processor):
 
         v, u = self.get_best_match(instance)
 
-        if self.distance(v.protype, instance) <= v.radius:
+        distance = self.distance(self.prototypes.get(v.id), instance)
+
+        if distance <= self.prototypes.radius(v.id):
 
             v.add_instance(tag)
 
             self.point_to_cluster[tag] = v.id
 
-            error_value = np.power(self.distance(
-                v.protype, instance), 2)[0]
+            error_value = np.power(distance, 2)[0]
 
             self.increment_error(v, error_value)
 
@@ -215,14 +385,13 @@ class GTurbo(Processor):
 
                 self.update_prototype(node, self.epsilon_n, instance)
 
-            self.age_links(v)
+            self.graph.age_links(v)
 
             if not self.graph.has_link(v, u):
 
                 self.create_link(v, u)
 
-            link = self.graph.get_link(v, u)
-            link.renew()
+            self.graph.renew_link(v, u)
 
             self.update_edges(v)
             self.update_nodes()
@@ -236,18 +405,154 @@ class GTurbo(Processor):
 
             self.create_link(v, r)
 
+    def process_batch(self, tags: Sequence[str], instances: np.ndarray) -> None:
+        """
+        Approximate mini-batch version of calling `turbo_step` for each sample.
+
+        Samples are taken in blocks of up to `batch_size` that never cross a
+        `lam` boundary, so `turbo_increase` runs after the same samples as in
+        the sequential mode. Within a block the winners of every sample are
+        found against the prototypes as they were at the start of the block,
+        prototype moves and error increments are summed per node, and only the
+        link ageing runs sample by sample. Nodes created by one sample are not
+        candidates for the rest of its block.
+        """
+
+        instances = np.asarray(instances, dtype='float32').reshape(len(tags), self.dimensions)
+
+        start = 0
+
+        while start < len(tags):
+
+            size = max(1, min(self.batch_size, self.lam - self.step, len(tags) - start))
+
+            # The block's errors are decayed as of its last sample.
+            self.step += size - 1
+
+            self.turbo_adapt_block(tags[start:start + size], instances[start:start + size])
+
+            if self.step >= self.lam - 1:
+
+                self.turbo_increase()
+                self.cycle += 1
+                self.step = 0
+
+            else:
+
+                self.step += 1
+
+            start += size
+
+    def turbo_adapt_block(self, tags: Sequence[str], instances: np.ndarray) -> None:
+
+        nearest = self.prototypes.nearest(instances, 2, expanded=True)
+        winners = [self.graph.get_node(id) for id in nearest[:, 0].tolist()]
+        seconds = [self.graph.get_node(id) for id in nearest[:, 1].tolist()]
+
+        rows = self.prototypes.get_rows(nearest[:, 0])
+        winner_prototypes = self.prototypes.matrix[rows].astype(np.float64)
+        distances = np.linalg.norm(instances.astype(np.float64) - winner_prototypes, axis=1)
+        in_radius = (distances <= self.prototypes.radiuses[rows]).tolist()
+
+        # The in-radius samples of each winner, in the order the winners
+        # were first seen.
+        positions: Dict[int, List[int]] = {}
+
+        for position, (tag, v, u, inside) in enumerate(zip(tags, winners, seconds, in_radius)):
+
+            if inside:
+
+                v.add_instance(tag)
+                self.point_to_cluster[tag] = v.id
+
+                positions.setdefault(v.id, []).append(position)
+
+                self.graph.age_links(v)
+
+                if not self.graph.has_link(v, u):
+
+                    self.create_link(v, u)
+
+                self.graph.renew_link(v, u)
+
+                self.update_edges(v)
+
+            else:
+
+                r = self.create_node_from_instance(instances[position], self.r0)
+                r.add_instance(tag)
+
+                self.point_to_cluster[tag] = r.id
+
+                self.create_link(v, r)
+
+        if len(positions) > 0:
+
+            self.apply_block_updates(instances, distances, positions)
+
+        self.update_nodes()
+
+    def apply_block_updates(self, instances: np.ndarray, distances: np.ndarray,
+                            positions: Dict[int, List[int]]) -> None:
+
+        winner_ids = list(positions)
+        sample_winner = np.empty(len(instances), dtype=np.int64)
+        taken = np.zeros(len(instances), dtype=bool)
+
+        for index, id in enumerate(winner_ids):
+
+            sample_winner[positions[id]] = index
+            taken[positions[id]] = True
+
+        samples = instances[taken].astype(np.float64)
+        sample_winner = sample_winner[taken]
+
+        sums = np.zeros((len(winner_ids), self.dimensions))
+        np.add.at(sums, sample_winner, samples)
+        counts = np.bincount(sample_winner, minlength=len(winner_ids))
+        errors = np.bincount(sample_winner, weights=distances[taken] ** 2, minlength=len(winner_ids))
+
+        neighbor_sums: Dict[int, np.ndarray] = {}
+        neighbor_counts: Dict[int, int] = {}
+
+        for index, id in enumerate(winner_ids):
+
+            v = self.graph.get_node(id)
+
+            self.increment_error(v, errors[index])
+
+            self.move_prototype(v, self.epsilon_b, sums[index], counts[index])
+
+            for node in v.topological_neighbors.values():
+
+                if node.id in neighbor_sums:
+                    neighbor_sums[node.id] += sums[index]
+                    neighbor_counts[node.id] += counts[index]
+
+                else:
+                    neighbor_sums[node.id] = sums[index].copy()
+                    neighbor_counts[node.id] = counts[index]
+
+        for id, total in neighbor_sums.items():
+
+            self.move_prototype(self.graph.get_node(id), self.epsilon_n, total, neighbor_counts[id])
+
+    def move_prototype(self, v: Node, scale: float, total: np.ndarray, count: int) -> None:
+
+        # `count` moves of `scale` towards the same point add up to a single
+        # move of 1 - (1 - scale)^count, which also keeps big blocks stable.
+        self.update_prototype(v, 1 - (1 - scale) ** count, total / count)
+
     def decrease_error(self, v: Node) -> None:
 
         self.fix_error(v)
 
         v.error *= self.alpha
-        self.graph.update_heap()
+        self.graph.update_priority(v)
 
     def create_link(self, v: Node, u: Node) -> None:
 
-        link = Link(v, u)
-
-        self.graph.insert_link(v, u, link)
+        self.graph.insert_link(v, u)
 
         v.add_neighbor(u)
         u.add_neighbor(v)
@@ -256,7 +561,10 @@ class GTurbo(Processor):
 
         nodes_to_remove = []
 
-        for node in self.graph.nodes.values():
+        # Only nodes that lost a link or an instance can have become orphans.
+        for id in sorted(self.graph.take_dirty()):
+
+            node = self.graph.nodes[id]
 
             if len(node.topological_neighbors) == 0 and len(node.instances) == 0:
 
@@ -265,27 +573,14 @@ class GTurbo(Processor):
         for node in nodes_to_remove:
 
             self.graph.remove_node(node)
-            self.index.remove_ids(np.array([node.id]))
-
-    def age_links(self, v: Node) -> None:
-
-        for u in v.topological_neighbors.values():
-
-            link = self.graph.get_link(v, u)
-
-            link.fade()
+            self.prototypes.remove(node.id)
 
     def update_edges(self, v: Node) -> None:
 
-        links_to_remove = []
-
-        for u in v.topological_neighbors.values():
-
-            link = self.graph.get_link(v, u)
-
-            if link.age > self.max_age:
-
-                links_to_remove.append((v, u))
+        links_to_remove = [
+            (v, v.topological_neighbors[id])
+            for id in self.graph.expired_links(v, self.max_age)
+        ]
 
         for v, u in links_to_remove:
 
@@ -298,6 +593,16 @@ class GTurbo(Processor):
 
         self.turbo_step(tag, instance)
 
+    def process_many(self, tags: Sequence[str], instances: np.ndarray) -> None:
+
+        if self.batch_size == 1:
+
+            super().process_many(tags, instances)
+
+        else:
+
+            self.process_batch(tags, instances)
+
     def update(self, tag: str, instance: np.ndarray) -> None:
 
         self.remove(tag)
@@ -310,6 +615,7 @@ class GTurbo(Processor):
 
         node = self.graph.get_node(node_id)
         node.remove_instance(tag)
+        self.graph.mark_dirty(node)
 
     def get_cluster_by_tag(self, tag: str) -> int:
 
@@ -317,8 +623,12 @@ class GTurbo(Processor):
 
     def get_tags_in_cluster(self, cluster_id: int) -> Sequence[str]:
 
-        return [tag for tag, id in self.point_to_cluster.items() if id ==
-                cluster_id]
+        node = self.graph.nodes.get(cluster_id)
+
+        if node is None:
+            return []
+
+        return list(node.instances)
     
     def get_cluster_ids(self) -> Sequence[int]:
         return [
@@ -326,10 +636,22 @@ class GTurbo(Processor):
             for node in self.graph.nodes
         ]
 
+    def get_cluster_sizes(self) -> Dict[int, int]:
+
+        return {id: len(node.instances) for id, node in self.graph.nodes.items()}
+
     def predict(self, instance: np.ndarray) -> int:
 
         return self.get_best_match(instance)[0].id
 
+    def predict_many(self, instances: np.ndarray) -> Sequence[int]:
+
+        return [int(id) for id in self.prototypes.nearest(instances, 1)[:, 0]]
+
+    def predict_top_n(self, instance: np.ndarray, n: int) -> Sequence[int]:
+
+        return [int(id) for id in self.prototypes.nearest(instance, max(1, n))[0]]
+
     def describe(self) -> Dict[str, Any]:
 
         return {
@@ -341,31 +663,198 @@ class GTurbo(Processor):
                 "beta": self. beta,
                 "alpha": self.alpha,
                 "max_age": self.max_age,
-                "radius": self.r0
+                "radius": self.r0,
+                **({"batch_size": self.batch_size} if self.batch_size != 1 else {})
             }
         }
 
     def safe_file_name(self) -> str:
 
-        return f"GTurbo = epsilon_b={self.epsilon_b};epsilon_n={self.epsilon_n};lam={self.lam};beta={self.beta};alpha={self.alpha};max_age={self.max_age};radius={self.r0}"
+        batch = f";batch_size={self.batch_size}" if self.batch_size != 1 else ""
 
+        return f"GTurbo = epsilon_b={self.epsilon_b};epsilon_n={self.epsilon_n};lam={self.lam};beta={self.beta};alpha={self.alpha};max_age={self.max_age};radius={self.r0}{batch}"
 
-class Graph:
+    def save(self, path: str) -> None:
+
+        nodes = list(self.graph.nodes.values())
+        prototypes = len(self.prototypes)
+
+        save_state(path, "GTurbo", {
+            "epsilon_b": self.epsilon_b,
+            "epsilon_n": self.epsilon_n,
+            "lam": self.lam,
+            "beta": self.beta,
+            "alpha": self.alpha,
+            "max_age": self.max_age,
+            "r0": self.r0,
+            "dimensions": self.dimensions,
+            "batch_size": self.batch_size,
+            "next_id": self.next_id,
+            "cycle": self.cycle,
+            "step": self.step,
+            "queue_counter": self.graph.queue.counter
+        }, {
+            "node_ids": np.array([node.id for node in nodes], dtype=np.int64),
+            "node_errors": np.array([node.error for node in nodes], dtype=np.float64),
+            "node_error_cycles": np.array([node.error_cycle for node in nodes], dtype=np.int64),
+            "node_queue_entries": np.array([self.graph.queue.entries[node.id] for node in nodes], dtype=np.int64),
+            "instance_counts": np.array([len(node.instances) for node in nodes], dtype=np.int64),
+            "instance_tags": tags_to_array(tag for node in nodes for tag in node.instances),
+            "neighbor_counts": np.array([len(node.links) for node in nodes], dtype=np.int64),
+            "neighbor_ids": np.array([id for node in nodes for id in node.links], dtype=np.int64),
+            "neighbor_slots": np.array([slot for node in nodes for slot in node.links.values()], dtype=np.int64),
+            "link_ages": self.graph.links.ages[:self.graph.links.size],
+            "link_free": np.array(self.graph.links.free, dtype=np.int64),
+            "prototype_ids": self.prototypes.ids[:prototypes],
+            "prototype_radiuses": self.prototypes.radiuses[:prototypes],
+            "prototype_matrix": self.prototypes.matrix[:prototypes],
+            "dirty": np.array(sorted(self.graph.dirty), dtype=np.int64)
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "GTurbo":
+
+        parameters, arrays = load_state(path, "GTurbo")
+
+        gturbo = cls(
+            parameters["epsilon_b"], parameters["epsilon_n"], parameters["lam"], parameters["beta"],
+            parameters["alpha"], parameters["max_age"], parameters["r0"],
+            dimensions=parameters["dimensions"], batch_size=parameters["batch_size"])
+
+        gturbo.next_id = parameters["next_id"]
+        gturbo.cycle = parameters["cycle"]
+        gturbo.step = parameters["step"]
+
+        # The prototypes come back as one block copy, rows in the same order.
+        gturbo.prototypes = PrototypeMatrix.from_arrays(
+            arrays["prototype_ids"], arrays["prototype_matrix"], arrays["prototype_radiuses"])
+
+        graph = Graph(gturbo.error_priority)
+        gturbo.graph = graph
+
+        graph.links.restore(arrays["link_ages"], arrays["link_free"].tolist())
+
+        node_ids = arrays["node_ids"].tolist()
+        instances = split_by_counts(arrays["instance_tags"].tolist(), arrays["instance_counts"])
+
+        for id, error, error_cycle, tags in zip(
+                node_ids, arrays["node_errors"].tolist(), arrays["node_error_cycles"].tolist(), instances):
+
+            node = Node(error, id, error_cycle)
+            node.instances = dict.fromkeys(tags)
+
+            graph.nodes[id] = node
+
+            for tag in node.instances:
+                gturbo.point_to_cluster[tag] = id
+
+        neighbor_ids = split_by_counts(arrays["neighbor_ids"].tolist(), arrays["neighbor_counts"])
+        neighbor_slots = split_by_counts(arrays["neighbor_slots"].tolist(), arrays["neighbor_counts"])
+
+        for id, neighbors, slots in zip(node_ids, neighbor_ids, neighbor_slots):
+
+            node = graph.nodes[id]
+
+            for neighbor, slot in zip(neighbors, slots):
+
+                node.links[neighbor] = slot
+                node.topological_neighbors[neighbor] = graph.nodes[neighbor]
+
+        graph.queue.restore(
+            node_ids,
+            [gturbo.error_priority(graph.nodes[id]) for id in node_ids],
+            arrays["node_queue_entries"].tolist(),
+            parameters["queue_counter"])
+
+        graph.dirty = set(arrays["dirty"].tolist())
+
+        return gturbo
+
+
+class ErrorQueue:
+    """
+    Max-priority queue of node ids with lazy deletion: changing a priority
+    pushes a new entry and older entries of the same node are skipped when
+    they reach the top.
+    """
 
     def __init__(self) -> None:
 
-        self.nodes: Dict[int, Node] = {}
-        self.links: Dict[Tuple[int, int], Link] = {}
-        self.heap = []
+        self.heap: List[Tuple[float, int, int]] = []
+        self.entries: Dict[int, int] = {}
+        self.counter = 0
+
+    def push(self, id: int, priority: float) -> None:
+
+        self.counter += 1
+        self.entries[id] = self.counter
+        heapq.heappush(self.heap, (-priority, self.counter, id))
 
-    def update_heap(self) -> None:
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self._compact()
 
+    def remove(self, id: int) -> None:
+
+        self.entries.pop(id, None)
+
+    def restore(self, ids: List[int], priorities: List[float], entries: List[int], counter: int) -> None:
+        """
+        Rebuilds the queue with only the live entries, keeping their original
+        push order so ties are still broken the same way.
+        """
+
+        self.entries = dict(zip(ids, entries))
+        self.heap = [(-priority, entry, id) for id, priority, entry in zip(ids, priorities, entries)]
+        self.counter = counter
+
+        heapq.heapify(self.heap)
+
+    def top(self) -> int:
+
+        while self.entries.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+
+        return self.heap[0][2]
+
+    def _compact(self) -> None:
+
+        self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
         heapq.heapify(self.heap)
 
+
+class Graph:
+
+    def __init__(self, priority: Callable[[Node], float]) -> None:
+
+        self.nodes: Dict[int, Node] = {}
+        self.links = LinkTable()
+        self.priority = priority
+        self.queue = ErrorQueue()
+
+        # Ids of the nodes that may have been left without links and
+        # instances since the last sweep.
+        self.dirty: Set[int] = set()
+
+    def mark_dirty(self, node: Node) -> None:
+
+        self.dirty.add(node.id)
+
+    def take_dirty(self) -> Set[int]:
+
+        dirty = self.dirty
+        self.dirty = set()
+
+        return dirty
+
+    def update_priority(self, node: Node) -> None:
+
+        self.queue.push(node.id, self.priority(node))
+
     def insert_node(self, node: Node) -> None:
 
         self.nodes[node.id] = node
-        heapq.heappush(self.heap, node)
+        self.update_priority(node)
+        self.mark_dirty(node)
 
     def remove_node(self, node: Node) -> None:
 
@@ -375,45 +864,71 @@ class Graph:
 
         self.nodes.pop(node.id)
 
-        self.heap.remove(node)
-        heapq.heapify(self.heap)
+        self.queue.remove(node.id)
+        self.dirty.discard(node.id)
         
     def get_node(self, id) -> Node:
 
         return self.nodes[id]
 
-    def insert_link(self, v: Node, u: Node, link) -> None:
+    def insert_link(self, v: Node, u: Node) -> None:
 
-        self.links[(v.id, u.id)] = link
+        slot = self.links.allocate()
+
+        v.links[u.id] = slot
+        u.links[v.id] = slot
 
     def remove_link(self, v: Node, u: Node) -> None:
 
-        if self.links.get((v.id, u.id), None) != None:
+        self.mark_dirty(v)
+        self.mark_dirty(u)
+
+        slot = v.links.pop(u.id, None)
+        u.links.pop(v.id, None)
 
-            self.links.pop((v.id, u.id))
+        if slot is not None:
 
-        elif self.links.get((u.id, v.id), None) != None:
-            self.links.pop((u.id, v.id))
-            
+            self.links.release(slot)
 
     def has_link(self, v: Node, u: Node) -> bool:
 
-        return (self.links.get((v.id, u.id), None) != None) or (self.links.get((u.id, v.id), None) != None)
-            
-    def get_link(self, v: Node, u: Node) -> Optional[Link]:
+        return u.id in v.links
+
+    def link_age(self, v: Node, u: Node) -> int:
+
+        return int(self.links.ages[v.links[u.id]])
+
+    def renew_link(self, v: Node, u: Node) -> None:
+
+        self.links.ages[v.links[u.id]] = 0
+
+    def age_links(self, v: Node) -> None:
+
+        if len(v.links) > 0:
+
+            self.links.ages[list(v.links.values())] += 1
+
+    def expired_links(self, v: Node, max_age: int) -> List[int]:
+        """
+        The ids of the neighbours of `v` whose link is older than `max_age`.
+        """
+
+        if len(v.links) == 0:
+            return []
 
-        link = self.links.get((v.id, u.id), None)
+        slots = np.fromiter(v.links.values(), dtype=np.int64, count=len(v.links))
+        expired = np.flatnonzero(self.links.ages[slots] > max_age)
 
-        if link != None:
+        if len(expired) == 0:
+            return []
 
-            return link
+        ids = list(v.links)
 
-        return self.links.get((u.id, v.id), None)
+        return [ids[index] for index in expired.tolist()]
 
     def get_q_and_f(self) -> Tuple[Node, Node]:
 
-        q = self.heap[0]
-        f = sorted(q.topological_neighbors.values(), 
-                                    key=lambda node: node.error, reverse=True)[0]
+        q = self.nodes[self.queue.top()]
+        f = max(q.topological_neighbors.values(), key=self.priority)
 
         return (q, f)
\ No newline at end of file
@@ -15,6 +15,18 @@ class Processor(Protocol):
     @abstractmethod
     def remove(self, tag: str) -> None:...
 
+    def process_many(self, tags: Sequence[str], instances: numpy.ndarray) -> None:
+        for tag, instance in zip(tags, instances):
+            self.process(tag, instance)
+
+    def update_many(self, tags: Sequence[str], instances: numpy.ndarray) -> None:
+        for tag, instance in zip(tags, instances):
+            self.update(tag, instance)
+
+    def remove_many(self, tags: Sequence[str]) -> None:
+        for tag in tags:
+            self.remove(tag)
+
     @abstractmethod
     def get_cluster_by_tag(self, tag: str) -> int:...
 
@@ -24,11 +36,37 @@ class Processor(Protocol):
     @abstractmethod
     def get_cluster_ids(self) -> Sequence[int]:...
 
+    def get_cluster_sizes(self) -> Dict[int, int]:
+        """
+        The number of tags in each cluster, by cluster id.
+        """
+        return {
+            cluster_id: len(self.get_tags_in_cluster(cluster_id))
+            for cluster_id in self.get_cluster_ids()
+        }
+
     @abstractmethod
     def predict(self, instance: numpy.ndarray) -> int:...
 
+    @abstractmethod
+    def predict_top_n(self, instance: numpy.ndarray, n: int) -> Sequence[int]:...
+
+    def predict_many(self, instances: numpy.ndarray) -> Sequence[int]:
+        return [self.predict(instance) for instance in instances]
+
     @abstractmethod
     def describe(self) -> Dict[str, Any]:...
 
     @abstractmethod
-    def safe_file_name(self) -> str:...
\ No newline at end of file
+    def safe_file_name(self) -> str:...
+
+    @abstractmethod
+    def save(self, path: str) -> None:
+        """
+        Writes the state to the directory `path` as flat NumPy arrays, so
+        `load` can restore it without replaying the operations.
+        """
+
+    @classmethod
+    @abstractmethod
+    def load(cls, path: str) -> "Processor":...
\ No newline at end of file
@@ -0,0 +1,338 @@
+import json
+import os
+import shutil
+
+import numpy
+
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from interference.util.persistence import load_state, save_state, tags_to_array
+from interference.util.rows import RowIndex
+
+
+class EmbeddingStore:
+    """
+    Keeps every embedding as a row of one growable float32 matrix and maps
+    each tag to its row. Removing a tag moves the last row into the freed
+    slot, so the used rows are always `matrix[:len(store)]`.
+    """
+
+    def __init__(self, dimensions: Optional[int] = None, initial_capacity: int = 1024) -> None:
+        self.dimensions = dimensions
+        self.initial_capacity = max(1, initial_capacity)
+
+        self.row_index: RowIndex[str] = RowIndex()
+
+        self.matrix: Optional[numpy.ndarray] = None
+
+        if dimensions is not None:
+            self.matrix = self._allocate(self.initial_capacity, dimensions)
+
+    def __len__(self) -> int:
+        return len(self.row_index)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.row_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.row_index.rows)
+
+    def __getitem__(self, tag: str) -> numpy.ndarray:
+        assert self.matrix is not None
+        return self.matrix[self.row_index[tag]].copy()
+
+    def keys(self):
+        return self.row_index.rows.keys()
+
+    def tags(self) -> List[str]:
+        """
+        The stored tags in row order, aligned with `embeddings`.
+        """
+        return list(self.row_index.keys)
+
+    @property
+    def embeddings(self) -> numpy.ndarray:
+        """
+        A view over the used rows. It is invalidated by the next mutation.
+        """
+        if self.matrix is None:
+            return numpy.empty((0, self.dimensions or 0), dtype=numpy.float32)
+
+        return self.matrix[:len(self)]
+
+    def add(self, tag: str, embedding: numpy.ndarray) -> None:
+        if tag in self.row_index:
+            self.update(tag, embedding)
+            return
+
+        embedding = self._as_row(embedding)
+
+        self._ensure_capacity(len(self) + 1)
+
+        assert self.matrix is not None
+
+        self.matrix[self.row_index.append(tag)] = embedding
+
+    def update(self, tag: str, embedding: numpy.ndarray) -> None:
+        assert self.matrix is not None
+        self.matrix[self.row_index[tag]] = self._as_row(embedding)
+
+    def remove(self, tag: str) -> None:
+        assert self.matrix is not None
+
+        self.row_index.remove(tag, (self.matrix,))
+
+    def add_many(self, tags: Sequence[str], embeddings: numpy.ndarray) -> None:
+        """
+        Same as calling `add` for each pair in order, with a single copy
+        into the matrix.
+        """
+        embeddings = self._as_rows(embeddings, len(tags))
+
+        rows: Dict[int, int] = {}
+
+        for position, tag in enumerate(tags):
+            row = self.row_index.rows.get(tag)
+
+            if row is None:
+                row = self.row_index.append(tag)
+
+            rows[row] = position
+
+        if len(rows) == 0:
+            return
+
+        self._ensure_capacity(len(self))
+
+        assert self.matrix is not None
+
+        self.matrix[list(rows.keys())] = embeddings[list(rows.values())]
+
+    def update_many(self, tags: Sequence[str], embeddings: numpy.ndarray) -> None:
+        embeddings = self._as_rows(embeddings, len(tags))
+
+        rows = { self.row_index[tag]: position for position, tag in enumerate(tags) }
+
+        if len(rows) == 0:
+            return
+
+        assert self.matrix is not None
+
+        self.matrix[list(rows.keys())] = embeddings[list(rows.values())]
+
+    def remove_many(self, tags: Sequence[str]) -> None:
+        for tag in tags:
+            self.remove(tag)
+
+    def row(self, tag: str) -> numpy.ndarray:
+        """
+        The embedding of `tag` as a view, without copying. It is invalidated
+        by the next mutation.
+        """
+        assert self.matrix is not None
+        return self.matrix[self.row_index[tag]]
+
+    def get_rows(self, tags: Sequence[str]) -> numpy.ndarray:
+        return self.row_index.get_rows(tags)
+
+    def get_many(self, tags: Sequence[str]) -> numpy.ndarray:
+        """
+        The embeddings of `tags`, in order, gathered into a single array.
+        """
+        if self.matrix is None:
+            return numpy.empty((0, self.dimensions or 0), dtype=numpy.float32)
+
+        return self.matrix[self.get_rows(tags)]
+
+    def save(self, path: str) -> None:
+        """
+        Writes the tags and the used rows to `path`.
+        """
+        save_state(path, "EmbeddingStore", {
+            "dimensions": self.dimensions
+        }, {
+            "tags": tags_to_array(self.row_index.keys),
+            "embeddings": self.embeddings
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingStore":
+        parameters, arrays = load_state(path, "EmbeddingStore")
+
+        tags = arrays["tags"].tolist()
+
+        store = cls(parameters["dimensions"], initial_capacity=len(tags))
+
+        if len(tags) > 0:
+            assert store.matrix is not None
+
+            store.matrix[:len(tags)] = arrays["embeddings"]
+            store.row_index = RowIndex(tags)
+
+        return store
+
+    def _as_row(self, embedding: numpy.ndarray) -> numpy.ndarray:
+        embedding = numpy.asarray(embedding, dtype=numpy.float32).reshape(-1)
+
+        if self.dimensions is None:
+            self.dimensions = embedding.shape[0]
+
+        if embedding.shape[0] != self.dimensions:
+            raise ValueError(
+                f"Expected an embedding with {self.dimensions} dimensions, got {embedding.shape[0]}.")
+
+        return embedding
+
+    def _as_rows(self, embeddings: numpy.ndarray, count: int) -> numpy.ndarray:
+        if count == 0:
+            return numpy.empty((0, self.dimensions or 0), dtype=numpy.float32)
+
+        embeddings = numpy.asarray(embeddings, dtype=numpy.float32).reshape(count, -1)
+
+        if self.dimensions is None:
+            self.dimensions = embeddings.shape[1]
+
+        if embeddings.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected embeddings with {self.dimensions} dimensions, got {embeddings.shape[1]}.")
+
+        return embeddings
+
+    def _ensure_capacity(self, size: int) -> None:
+        assert self.dimensions is not None
+
+        if self.matrix is None:
+            self.matrix = self._allocate(max(self.initial_capacity, size), self.dimensions)
+
+        elif size > self.matrix.shape[0]:
+            self.matrix = self._grow(self.matrix, max(size, 2 * self.matrix.shape[0]))
+
+    def _allocate(self, capacity: int, dimensions: int) -> numpy.ndarray:
+        return numpy.empty((capacity, dimensions), dtype=numpy.float32)
+
+    def _grow(self, matrix: numpy.ndarray, capacity: int) -> numpy.ndarray:
+        used = min(len(self), matrix.shape[0])
+
+        grown = self._allocate(capacity, matrix.shape[1])
+        grown[:used] = matrix[:used]
+        return grown
+
+
+class MemmapEmbeddingStore(EmbeddingStore):
+    """
+    An `EmbeddingStore` backed by files in `path`: the matrix is a
+    memory-mapped float32 file and the tags are kept in row order in a
+    separate index file. Opening an existing `path` only reads the index,
+    rows are paged in lazily.
+
+    Changes to the index are only written by `flush`.
+    """
+
+    MATRIX_FILE = "embeddings.f32"
+    TAGS_FILE = "tags.npy"
+    META_FILE = "meta.json"
+
+    def __init__(self, path: str, dimensions: Optional[int] = None, initial_capacity: int = 1024) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        super().__init__(None, initial_capacity)
+
+        if os.path.exists(self._file(self.META_FILE)):
+            self._open()
+
+        elif dimensions is not None:
+            self.dimensions = dimensions
+            self.matrix = self._allocate(self.initial_capacity, dimensions)
+
+    def flush(self) -> None:
+        if self.matrix is None:
+            return
+
+        self.matrix.flush()
+
+        tags_file = self._file(self.TAGS_FILE)
+        with open(tags_file + ".tmp", "wb") as f:
+            numpy.save(f, numpy.array(self.row_index.keys, dtype=str), allow_pickle=False)
+        os.replace(tags_file + ".tmp", tags_file)
+
+        meta_file = self._file(self.META_FILE)
+        with open(meta_file + ".tmp", "w") as f:
+            json.dump({
+                "dimensions": self.dimensions,
+                "capacity": self.matrix.shape[0],
+                "size": len(self)
+            }, f)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    def close(self) -> None:
+        self.flush()
+        self.matrix = None
+
+    def save(self, path: str) -> None:
+        """
+        Flushes the store and copies its files to `path` file by file, so
+        nothing is read into memory. `load` reopens the copy in place.
+        """
+        self.flush()
+
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            for name in (self.MATRIX_FILE, self.TAGS_FILE, self.META_FILE):
+                if os.path.exists(self._file(name)):
+                    shutil.copyfile(self._file(name), os.path.join(path, name))
+
+        save_state(path, "MemmapEmbeddingStore", { "dimensions": self.dimensions }, {})
+
+    @classmethod
+    def load(cls, path: str) -> "MemmapEmbeddingStore":
+        """
+        Reopens what `save` wrote as a store backed by the files in `path`,
+        so later changes are made to them.
+        """
+        parameters, _ = load_state(path, "MemmapEmbeddingStore")
+
+        return cls(path, parameters["dimensions"])
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open(self) -> None:
+        with open(self._file(self.META_FILE)) as f:
+            meta = json.load(f)
+
+        self.dimensions = meta["dimensions"]
+        self.matrix = numpy.memmap(
+            self._file(self.MATRIX_FILE),
+            dtype=numpy.float32,
+            mode="r+",
+            shape=(meta["capacity"], self.dimensions)
+        )
+
+        self.row_index = RowIndex(numpy.load(self._file(self.TAGS_FILE), allow_pickle=False).tolist()[:meta["size"]])
+
+    def _allocate(self, capacity: int, dimensions: int) -> numpy.ndarray:
+        return numpy.memmap(
+            self._file(self.MATRIX_FILE),
+            dtype=numpy.float32,
+            mode="w+",
+            shape=(capacity, dimensions)
+        )
+
+    def _grow(self, matrix: numpy.ndarray, capacity: int) -> numpy.ndarray:
+        assert isinstance(matrix, numpy.memmap)
+
+        matrix.flush()
+        del matrix
+        self.matrix = None
+
+        with open(self._file(self.MATRIX_FILE), "r+b") as f:
+            f.truncate(capacity * self.dimensions * numpy.dtype(numpy.float32).itemsize)
+
+        return numpy.memmap(
+            self._file(self.MATRIX_FILE),
+            dtype=numpy.float32,
+            mode="r+",
+            shape=(capacity, self.dimensions)
+        )
@@ -2,10 +2,10 @@ import logging
 from interference.util.statistics import stats_from_counter
 import numpy
 
-from sklearn.metrics import silhouette_score
-from typing import Dict, Any, TYPE_CHECKING
+from typing import Dict, Any, Optional, TYPE_CHECKING
 
-from interference.metrics.match import similarity_metric
+from interference.metrics.match import similarity_statistics
+from interference.metrics.silhouette import SilhouetteMode, silhouette
 
 from collections import Counter
 
@@ -20,28 +20,29 @@ if TYPE_CHECKING:
 def compute_cluster_score(interface: "Interface") -> float:
     node_scores = []
 
-    for cluster_id in interface.processor.get_cluster_ids():
+    # With second moments the statistics already hold what is needed, otherwise
+    # the embeddings of each cluster are read back.
+    statistics = interface.cluster_statistics
 
-        tags_in_cluster = interface.processor.get_tags_in_cluster(cluster_id)
-        number_of_tags = len(tags_in_cluster)
+    for cluster_id, number_of_tags in interface.processor.get_cluster_sizes().items():
 
         if number_of_tags == 0:
             continue
 
         elif number_of_tags == 1:
-            node_similarities = [1.0]
+            sim_mean, sim_std = 1.0, 0.0
 
-        else:
-            embeddings_in_cluster = list(interface.get_embeddings_by_tag(tags_in_cluster))
+        elif statistics.second_moments:
+            sim_mean, sim_std = statistics.similarity_statistics(cluster_id)
 
-            node_similarities = [
-                similarity_metric(test_embedding, compare_embedding)
-                for i, test_embedding in enumerate(embeddings_in_cluster[:-1])
-                for compare_embedding in embeddings_in_cluster[i + 1:]
-            ]
+        else:
+            tags_in_cluster = interface.processor.get_tags_in_cluster(cluster_id)
+            sim_mean, sim_std = similarity_statistics(interface.get_embeddings_by_tag(tags_in_cluster))
 
-        sim_mean = numpy.mean(node_similarities)
-        sim_std = numpy.std(node_similarities)
+        # Mean similarity 0 is an unbounded dispersion, which scores 0 below.
+        if sim_mean == 0:
+            node_scores.append(0.0)
+            continue
 
         node_dispersion = sim_std / sim_mean
 
@@ -56,34 +57,47 @@ def compute_cluster_score(interface: "Interface") -> float:
     return numpy.sum(node_scores)
 
 
-def eval_cluster(interface: "Interface") -> Dict[str, Any]:
+def compute_cluster_cohesion(interface: "Interface") -> Optional[float]:
+    """
+    The mean cosine similarity between tags of the same cluster, averaged
+    over the clusters with at least two tags. Read from the cluster
+    statistics in O(clusters).
+    """
+    statistics = interface.cluster_statistics
+
+    cohesions = [
+        statistics.similarity_statistics(cluster_id)[0]
+        for cluster_id, count in statistics.counts.items()
+        if count > 1
+    ]
+
+    if len(cohesions) == 0:
+        return None
+
+    return float(numpy.mean(cohesions))
+
 
-    tags = interface.embeddings_map.keys()
-    labels = []
-    embeddings = []
-    labels_set = set()
+def eval_cluster(interface: "Interface", silhouette_mode: SilhouetteMode = SilhouetteMode.FULL,
+                 sample_size: int = 10000, random_state: int = 42) -> Dict[str, Any]:
 
-    for tag in tags:
-        label = interface.processor.get_cluster_by_tag(tag)
+    Ss: Optional[float] = None
 
-        labels.append(label)
+    if silhouette_mode != SilhouetteMode.NONE:
 
-        labels_set.add(label)
-    
-        embeddings.append(interface.embeddings_map[tag])
+        labels = [
+            interface.processor.get_cluster_by_tag(tag)
+            for tag in interface.embedding_store.tags()
+        ]
 
-    try:
+        try:
 
-        Ss = silhouette_score(embeddings, labels) # type: ignore
-    except:
+            Ss = silhouette(interface.embedding_store.embeddings, labels, silhouette_mode, sample_size, random_state)
+        except (ValueError, MemoryError) as e:
 
-        Ss = -1.0
+            logger.warning(f"Could not compute the {silhouette_mode.name} silhouette score: {e!r}")
+            Ss = -1.0
 
-    num_instances_per_cluster = list(filter(lambda n: n > 0, 
-    (
-        len(interface.processor.get_tags_in_cluster(cluster_id))
-        for cluster_id in interface.processor.get_cluster_ids()
-    )))
+    num_instances_per_cluster = list(filter(lambda n: n > 0, interface.processor.get_cluster_sizes().values()))
 
     counter = Counter(num_instances_per_cluster)
 
@@ -94,10 +108,12 @@ def eval_cluster(interface: "Interface") -> Dict[str, Any]:
     avg, max, min = int_stats
 
     return {
-        'ss': float(Ss),
+        'ss': Ss,
+        'ss mode': silhouette_mode.name,
         'cluster_score': compute_cluster_score(interface),
-        '#clusters': len(labels_set),
-        '#instances': len(tags),
+        'average cluster cohesion': compute_cluster_cohesion(interface),
+        '#clusters': len(num_instances_per_cluster),
+        '#instances': len(interface.embedding_store),
         'distribution instances per cluster': distribution,
         'average instances per cluster': avg,
         'max instances per cluster': max,
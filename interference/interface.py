@@ -1,11 +1,16 @@
+import heapq
+import os
 import numpy
 
 
-from interference.scoring import ScoringCalculator, Scoring
+from interference.cluster_statistics import ClusterStatistics
+from interference.embedding_store import EmbeddingStore
+from interference.scoring import ScoringCalculator, Scoring, supports_batched
 from interference.transformers.transformer_pipeline import Instance, TransformerPipeline
 from interference.clusters.processor import Processor
+from interference.util.persistence import load_state, save_state, saved_type, type_name
 
-from typing import Any, Dict, List, Optional, Tuple, TypeVar, cast, Sequence
+from typing import Dict, List, Optional, Tuple, TypeVar, cast, Sequence
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -20,12 +25,19 @@ class Interface:
         self,
         processor: Processor,
         transformers: Dict[str, TransformerPipeline],
-        scoring_calculator: ScoringCalculator
+        scoring_calculator: ScoringCalculator,
+        embedding_store: Optional[EmbeddingStore] = None,
+        nprobe: int = 1,
+        cluster_statistics: Optional[ClusterStatistics] = None
     ) -> None:
         self.processor = processor
         self.transformers = transformers
         self.scoring_calculator = scoring_calculator
-        self.embeddings_map: Dict[str, numpy.ndarray] = {}
+        self.nprobe = nprobe
+        self.embedding_store = embedding_store if embedding_store is not None else EmbeddingStore()
+        # Only tags added through this interface are counted. A processor
+        # that already holds tags needs `rebuild_statistics`.
+        self.cluster_statistics = cluster_statistics if cluster_statistics is not None else ClusterStatistics()
 
     def try_get_transformer_for_key(self, key: str):
         return self.transformers.get(key, None)
@@ -41,35 +53,150 @@ class Interface:
         return transformer.transform(value)
 
     def add(self, tag: str, instance: Instance):
+        self._forget_tag_statistics(tag)
         self.processor.process(tag, instance.embedding)
-        self.embeddings_map[tag] = instance.embedding
+        self.embedding_store.add(tag, instance.embedding)
+        self._record_tag_statistics(tag)
 
     def update(self, tag: str, instance: Instance):
-        if not tag in self.embeddings_map:
+        if not tag in self.embedding_store:
             return False
         
+        self._forget_tag_statistics(tag)
         self.processor.update(tag, instance.embedding)
-        self.embeddings_map[tag] = instance.embedding
+        self.embedding_store.update(tag, instance.embedding)
+        self._record_tag_statistics(tag)
 
         return True
 
     def remove(self, tag: str):
-        if not tag in self.embeddings_map:
+        if not tag in self.embedding_store:
             return False
 
+        self._forget_tag_statistics(tag)
         self.processor.remove(tag)
-        del self.embeddings_map[tag]
+        self.embedding_store.remove(tag)
         return True
 
+    def add_many(self, tags: Sequence[str], instances: Sequence[Instance]) -> None:
+        if len(tags) == 0:
+            return
+
+        embeddings = numpy.array([ instance.embedding for instance in instances ])
+
+        self._forget_statistics(tags)
+        self.processor.process_many(tags, embeddings)
+        self.embedding_store.add_many(tags, embeddings)
+        self._record_statistics(tags)
+
+    def update_many(self, tags: Sequence[str], instances: Sequence[Instance]) -> List[bool]:
+        updated = [ tag in self.embedding_store for tag in tags ]
+
+        tags_to_update = [ tag for tag, present in zip(tags, updated) if present ]
+
+        if len(tags_to_update) > 0:
+            embeddings = numpy.array([
+                instance.embedding
+                for instance, present in zip(instances, updated)
+                if present
+            ])
+
+            self._forget_statistics(tags_to_update)
+            self.processor.update_many(tags_to_update, embeddings)
+            self.embedding_store.update_many(tags_to_update, embeddings)
+            self._record_statistics(tags_to_update)
+
+        return updated
+
+    def remove_many(self, tags: Sequence[str]) -> List[bool]:
+        removed: List[bool] = []
+        tags_to_remove: List[str] = []
+        seen = set()
+
+        for tag in tags:
+            present = tag in self.embedding_store and tag not in seen
+            removed.append(present)
+
+            if present:
+                tags_to_remove.append(tag)
+                seen.add(tag)
+
+        self._forget_statistics(tags_to_remove)
+        self.processor.remove_many(tags_to_remove)
+        self.embedding_store.remove_many(tags_to_remove)
+
+        return removed
+
+    def rebuild_statistics(self) -> None:
+        """
+        Recomputes the cluster statistics from the stored embeddings of the
+        tags the processor has clustered. Stored tags the processor does not
+        know, as in a reopened store with a new processor, are left out.
+        """
+        self.cluster_statistics.clear()
+
+        clustered = [ tag for tag in self.embedding_store.tags() if self._cluster_of(tag) is not None ]
+
+        if len(clustered) > 0:
+            self._record_statistics(clustered)
+
+    def _cluster_of(self, tag: str) -> Optional[int]:
+
+        try:
+            return self.processor.get_cluster_by_tag(tag)
+        except KeyError:
+            return None
+
+    def _forget_tag_statistics(self, tag: str) -> None:
+
+        if tag not in self.embedding_store:
+            return
+
+        cluster_id = self._cluster_of(tag)
+
+        if cluster_id is not None:
+            self.cluster_statistics.remove(cluster_id, self.embedding_store.row(tag))
+
+    def _record_tag_statistics(self, tag: str) -> None:
+
+        self.cluster_statistics.add(self.processor.get_cluster_by_tag(tag), self.embedding_store.row(tag))
+
+    def _forget_statistics(self, tags: Sequence[str]) -> None:
+
+        present = [ tag for tag in dict.fromkeys(tags) if tag in self.embedding_store ]
+        cluster_ids = [ self._cluster_of(tag) for tag in present ]
+
+        clustered = [ tag for tag, cluster_id in zip(present, cluster_ids) if cluster_id is not None ]
+
+        if len(clustered) == 0:
+            return
+
+        self.cluster_statistics.remove_many(
+            [ cluster_id for cluster_id in cluster_ids if cluster_id is not None ],
+            self.embedding_store.get_many(clustered)
+        )
+
+    def _record_statistics(self, tags: Sequence[str]) -> None:
+
+        tags = list(dict.fromkeys(tags))
+
+        self.cluster_statistics.add_many(
+            [ self.processor.get_cluster_by_tag(tag) for tag in tags ],
+            self.embedding_store.get_many(tags)
+        )
+
     def get_scorings_for(self, instance: Instance):
         
-        if len(self.embeddings_map) == 0:
+        if len(self.embedding_store) == 0:
             return []
 
-        would_be_cluster_id = self.processor.predict(instance.embedding)
+        tags = self._get_candidate_tags(instance.embedding)
+
+        if self.supports_batched_scoring():
+            similarity_scores, is_matches = self._score_batched(instance.embedding, tags)
+            return self._build_scorings(tags, similarity_scores, is_matches)
 
-        tags = self.processor.get_tags_in_cluster(would_be_cluster_id)
-        embeddings = [ self.embeddings_map[tag] for tag in tags ]
+        embeddings = self.embedding_store.get_many(tags)
 
         scorings: List[Scoring] = []
 
@@ -82,6 +209,19 @@ class Interface:
 
     
     def get_matches_for(self, instance: Instance):
+
+        if len(self.embedding_store) > 0 and self.supports_batched_scoring():
+            tags = self._get_candidate_tags(instance.embedding)
+            similarity_scores, is_matches = self._score_batched(instance.embedding, tags)
+
+            match_indexes = numpy.flatnonzero(is_matches)
+
+            return self._build_scorings(
+                [ tags[index] for index in match_indexes ],
+                similarity_scores[match_indexes],
+                is_matches[match_indexes]
+            )
+
         scorings = self.get_scorings_for(instance)
 
         return [
@@ -90,6 +230,162 @@ class Interface:
             if scoring.is_match
         ]
 
+    def get_scorings_for_many(self, instances: Sequence[Instance]) -> List[List[Scoring]]:
+        """
+        Same as calling `get_scorings_for` for each instance. All queries are
+        predicted in one call and grouped by cluster, so each cluster's
+        members are scored against all of its queries with one matrix product.
+        """
+        return self._score_many_instances(instances, only_matches=False)
+
+    def get_matches_for_many(self, instances: Sequence[Instance]) -> List[List[Scoring]]:
+        """
+        Same as calling `get_matches_for` for each instance, see
+        `get_scorings_for_many`.
+        """
+        return self._score_many_instances(instances, only_matches=True)
+
+    def _score_many_instances(self, instances: Sequence[Instance], only_matches: bool) -> List[List[Scoring]]:
+
+        if len(instances) == 0:
+            return []
+
+        if len(self.embedding_store) == 0:
+            return [ [] for _ in instances ]
+
+        if not supports_batched(self.scoring_calculator, "score_pairwise"):
+            if only_matches:
+                return [ self.get_matches_for(instance) for instance in instances ]
+
+            return [ self.get_scorings_for(instance) for instance in instances ]
+
+        queries = numpy.array([ instance.embedding for instance in instances ])
+
+        if self.nprobe <= 1:
+            probes = [ [cluster_id] for cluster_id in self.processor.predict_many(queries) ]
+        else:
+            probes = [ self.processor.predict_top_n(query, self.nprobe) for query in queries ]
+
+        queries_by_cluster: Dict[int, List[Tuple[int, int]]] = {}
+
+        for position, cluster_ids in enumerate(probes):
+            for rank, cluster_id in enumerate(cluster_ids):
+                queries_by_cluster.setdefault(cluster_id, []).append((position, rank))
+
+        results: List[List[List[Scoring]]] = [ [ [] for _ in cluster_ids ] for cluster_ids in probes ]
+
+        for cluster_id, positions_and_ranks in queries_by_cluster.items():
+
+            tags = self.processor.get_tags_in_cluster(cluster_id)
+
+            if len(tags) == 0:
+                continue
+
+            positions = [ position for position, _ in positions_and_ranks ]
+
+            similarity_scores, is_matches = self.scoring_calculator.score_pairwise(
+                queries[positions],
+                self.embedding_store.get_many(tags)
+            )
+
+            for row, (position, rank) in enumerate(positions_and_ranks):
+
+                if only_matches:
+                    match_indexes = numpy.flatnonzero(is_matches[row])
+
+                    results[position][rank] = self._build_scorings(
+                        [ tags[index] for index in match_indexes ],
+                        similarity_scores[row, match_indexes],
+                        is_matches[row, match_indexes]
+                    )
+
+                else:
+                    results[position][rank] = self._build_scorings(tags, similarity_scores[row], is_matches[row])
+
+        return [
+            [ scoring for scorings in by_rank for scoring in scorings ]
+            for by_rank in results
+        ]
+
+    def get_top_k_matches(self, instance: Instance, k: int, min_score: Optional[float] = None) -> List[Scoring]:
+        """
+        The best `k` matches for `instance`, sorted by descending score.
+        If `min_score` is given it replaces the calculator's match criterion,
+        including in the `is_match` of the returned `Scoring`s. Only the `k`
+        selected candidates are turned into `Scoring`s.
+        """
+
+        if k <= 0 or len(self.embedding_store) == 0:
+            return []
+
+        if not self.supports_batched_scoring():
+            scorings = self.get_scorings_for(instance)
+
+            if min_score is None:
+                return heapq.nlargest(k, (scoring for scoring in scorings if scoring.is_match), key=lambda scoring: scoring.score)
+
+            matches = heapq.nlargest(k, (scoring for scoring in scorings if scoring.score >= min_score), key=lambda scoring: scoring.score)
+
+            for scoring in matches:
+                scoring.is_similarity_match = True
+
+            return matches
+
+        tags = self._get_candidate_tags(instance.embedding)
+        similarity_scores, is_matches = self._score_batched(instance.embedding, tags)
+
+        if min_score is not None:
+            is_matches = similarity_scores >= min_score
+
+        candidates = numpy.flatnonzero(is_matches)
+
+        if candidates.size > k:
+            candidates = candidates[numpy.argpartition(-similarity_scores[candidates], k - 1)[:k]]
+
+        candidates = candidates[numpy.argsort(-similarity_scores[candidates], kind='stable')]
+
+        return self._build_scorings(
+            [ tags[index] for index in candidates ],
+            similarity_scores[candidates],
+            is_matches[candidates]
+        )
+
+    def supports_batched_scoring(self) -> bool:
+        return supports_batched(self.scoring_calculator, "score_many")
+
+    def _get_candidate_tags(self, embedding: numpy.ndarray) -> Sequence[str]:
+
+        if self.nprobe <= 1:
+            would_be_cluster_id = self.processor.predict(embedding)
+            return self.processor.get_tags_in_cluster(would_be_cluster_id)
+
+        tags: List[str] = []
+
+        for cluster_id in self.processor.predict_top_n(embedding, self.nprobe):
+            tags.extend(self.processor.get_tags_in_cluster(cluster_id))
+
+        return tags
+
+    def _score_batched(self, embedding: numpy.ndarray, tags: Sequence[str]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+
+        if len(tags) == 0:
+            return numpy.empty(0), numpy.empty(0, dtype=bool)
+
+        embeddings = self.embedding_store.get_many(tags)
+
+        return self.scoring_calculator.score_many(embedding, embeddings)
+
+    def _build_scorings(self, tags: Sequence[str], similarity_scores: numpy.ndarray, is_matches: numpy.ndarray) -> List[Scoring]:
+
+        scorings: List[Scoring] = []
+
+        for tag, similarity_score, is_match in zip(tags, similarity_scores.tolist(), is_matches.tolist()):
+            scoring = Scoring(similarity_score, is_match)
+            scoring.scored_tag = tag
+            scorings.append(scoring)
+
+        return scorings
+
 
     def calculate_scoring_between_instances(self, instance1: Instance, instance2: Instance):
         return self.calculate_scoring_between_embeddings(instance1.embedding, instance2.embedding)
@@ -100,14 +396,65 @@ class Interface:
 
 
     def get_embeddings_by_tag(self, tags: Sequence[str]):
-        return [
-            self.embeddings_map[tag]
+        return self.embedding_store.get_many([
+            tag
             for tag in tags
-            if tag in self.embeddings_map
-        ]
+            if tag in self.embedding_store
+        ])
+
+    def save(self, path: str) -> None:
+        """
+        Saves the processor and the embeddings under `path`. Transformers and
+        the scoring calculator are configuration and are passed to `load`.
+        """
+        self.processor.save(os.path.join(path, "processor"))
+        self.embedding_store.save(os.path.join(path, "embeddings"))
+
+        save_state(path, "Interface", {
+            "processor": type_name(type(self.processor)),
+            "embedding_store": type_name(type(self.embedding_store)),
+            "nprobe": self.nprobe
+        }, {})
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        transformers: Dict[str, TransformerPipeline],
+        scoring_calculator: ScoringCalculator,
+        embedding_store: Optional[EmbeddingStore] = None,
+        cluster_statistics: Optional[ClusterStatistics] = None
+    ) -> "Interface":
+        """
+        Restores what `save` wrote. The embeddings are loaded with the type
+        of store they were saved from, so a `MemmapEmbeddingStore` is
+        reopened in place, unless `embedding_store` is given to be used
+        instead. The cluster statistics are not saved, they are rebuilt from
+        the embeddings into `cluster_statistics`.
+        """
+        parameters, _ = load_state(path, "Interface")
+
+        processor_type = saved_type(parameters["processor"])
+
+        if embedding_store is None:
+            store_type = saved_type(parameters["embedding_store"])
+            embedding_store = store_type.load(os.path.join(path, "embeddings"))
+
+        interface = cls(
+            processor_type.load(os.path.join(path, "processor")),
+            transformers,
+            scoring_calculator,
+            embedding_store,
+            parameters["nprobe"],
+            cluster_statistics
+        )
+        interface.rebuild_statistics()
+
+        return interface
 
     def describe(self):
         return {
             "transformers": { key: transformer.__class__.__name__  for key, transformer in self.transformers.items() },
-            "scoring_calculator": self.scoring_calculator.describe()
+            "scoring_calculator": self.scoring_calculator.describe(),
+            "nprobe": self.nprobe
         }
\ No newline at end of file
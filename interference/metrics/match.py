@@ -1,6 +1,95 @@
 import numpy
 from scipy.spatial.distance import cosine
+from typing import Tuple
 
 
 def similarity_metric(embedding1: numpy.ndarray, embedding2: numpy.ndarray) -> float:
-    return numpy.nan_to_num(1 - cosine(embedding1, embedding2), 0)
\ No newline at end of file
+    return numpy.nan_to_num(1 - cosine(embedding1, embedding2), nan=0.0)
+
+
+def similarity_metric_many(embedding: numpy.ndarray, embeddings: numpy.ndarray) -> numpy.ndarray:
+    """
+    Batched version of `similarity_metric`: the similarity between `embedding`
+    and every row of `embeddings`, computed with a single matrix-vector product.
+    """
+
+    embedding = numpy.asarray(embedding, dtype=numpy.float64)
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float64)
+
+    norms = numpy.linalg.norm(embeddings, axis=1) * numpy.linalg.norm(embedding)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        similarities = (embeddings @ embedding) / norms
+
+    return numpy.nan_to_num(similarities, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def similarity_metric_pairwise(embeddings1: numpy.ndarray, embeddings2: numpy.ndarray) -> numpy.ndarray:
+    """
+    The similarity between every row of `embeddings1` and every row of
+    `embeddings2`, as a (len(embeddings1), len(embeddings2)) matrix computed
+    with a single matrix product.
+    """
+
+    embeddings1 = numpy.asarray(embeddings1, dtype=numpy.float64)
+    embeddings2 = numpy.asarray(embeddings2, dtype=numpy.float64)
+
+    norms = numpy.outer(numpy.linalg.norm(embeddings1, axis=1), numpy.linalg.norm(embeddings2, axis=1))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        similarities = (embeddings1 @ embeddings2.T) / norms
+
+    return numpy.nan_to_num(similarities, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def normalized_rows(embeddings: numpy.ndarray) -> numpy.ndarray:
+
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float64)
+    norms = numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    # A zero embedding has similarity 0 with everything, as in `similarity_metric`.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.nan_to_num(embeddings / norms, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def similarity_statistics(embeddings: numpy.ndarray, block_size: int = 1024) -> Tuple[float, float]:
+    """
+    The mean and standard deviation of `similarity_metric` over every pair
+    of distinct rows of `embeddings`, without looping over the pairs.
+
+    With unit rows u_i summing to s, the pair sums are
+    sum(u_i . u_j) = (|s|^2 - sum |u_i|^2) / 2 and
+    sum((u_i . u_j)^2) = (|U^T U|_F^2 - sum |u_i|^4) / 2.
+    When there are fewer rows than dimensions the second one is taken from
+    blocks of U U^T instead, which is cheaper then.
+    """
+
+    units = normalized_rows(embeddings)
+    count = len(units)
+
+    if count < 2:
+        raise ValueError("At least two embeddings are needed to have a pair.")
+
+    pairs = count * (count - 1) / 2
+    squared_norms = numpy.einsum('nd,nd->n', units, units)
+
+    total = units.sum(axis=0)
+    similarity_sum = (total @ total - squared_norms.sum()) / 2
+
+    if units.shape[1] <= count:
+        gram = units.T @ units
+        squares_sum = (numpy.einsum('de,de->', gram, gram) - (squared_norms ** 2).sum()) / 2
+
+    else:
+        squares_sum = 0.0
+
+        for start in range(0, count, block_size):
+            block = units[start:start + block_size] @ units.T
+            squares_sum += numpy.einsum('nm,nm->', block, block)
+
+        squares_sum = (squares_sum - (squared_norms ** 2).sum()) / 2
+
+    mean = similarity_sum / pairs
+    variance = max(squares_sum / pairs - mean ** 2, 0.0)
+
+    return float(mean), float(numpy.sqrt(variance))
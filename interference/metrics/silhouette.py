@@ -0,0 +1,173 @@
+import numpy
+
+from enum import Enum, unique
+from sklearn.metrics import silhouette_score
+from typing import Sequence, Tuple
+
+
+@unique
+class SilhouetteMode(Enum):
+    # sklearn's silhouette_score over every embedding.
+    FULL = 0
+    # Exact silhouette of a per-cluster stratified sample.
+    SAMPLED = 1
+    # Exact silhouette over every embedding, streaming blocks of distances.
+    CHUNKED = 2
+    # Distances to cluster centroids instead of to every other embedding.
+    SIMPLIFIED = 3
+    # No silhouette, for when only the O(clusters) metrics are wanted.
+    NONE = 4
+
+
+def silhouette(embeddings: numpy.ndarray, labels: Sequence[int], mode: SilhouetteMode = SilhouetteMode.FULL,
+               sample_size: int = 10000, random_state: int = 42, block_size: int = 1024) -> float:
+    """
+    The mean silhouette coefficient of `embeddings` clustered as `labels`,
+    with Euclidean distances. Like sklearn, raises ValueError unless there
+    are between 2 and len(embeddings) - 1 distinct labels.
+    """
+
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float64)
+    labels = numpy.asarray(labels)
+
+    if mode == SilhouetteMode.FULL:
+        return float(silhouette_score(embeddings, labels))
+
+    if mode == SilhouetteMode.SAMPLED:
+        sample = stratified_sample(labels, sample_size, random_state)
+        return chunked_silhouette(embeddings[sample], labels[sample], block_size)
+
+    if mode == SilhouetteMode.CHUNKED:
+        return chunked_silhouette(embeddings, labels, block_size)
+
+    if mode == SilhouetteMode.NONE:
+        raise ValueError("SilhouetteMode.NONE does not compute a silhouette.")
+
+    return simplified_silhouette(embeddings, labels, block_size)
+
+
+def stratified_sample(labels: numpy.ndarray, sample_size: int, random_state: int) -> numpy.ndarray:
+    """
+    Sorted positions of about `sample_size` items, drawn from each label in
+    proportion to its size. Every label keeps at least two items, or its
+    only one, since a lone sampled item always scores 0, so with many small
+    labels the sample can be larger than `sample_size`.
+    """
+
+    if sample_size >= len(labels):
+        return numpy.arange(len(labels))
+
+    random = numpy.random.RandomState(random_state)
+
+    _, inverse, counts = numpy.unique(labels, return_inverse=True, return_counts=True)
+    quotas = numpy.maximum(numpy.minimum(counts, 2), numpy.round(counts * sample_size / len(labels)).astype(numpy.int64))
+
+    order = numpy.argsort(inverse, kind='stable')
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+
+    sample = [
+        random.choice(order[start:start + count], size=quota, replace=False)
+        for start, count, quota in zip(starts, counts, quotas)
+    ]
+
+    return numpy.sort(numpy.concatenate(sample))
+
+
+def _encode_labels(labels: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+
+    _, inverse, counts = numpy.unique(labels, return_inverse=True, return_counts=True)
+
+    if not 2 <= len(counts) <= len(labels) - 1:
+        raise ValueError(
+            f"Number of labels is {len(counts)}. Valid values are 2 to n_samples - 1 (inclusive)")
+
+    return inverse.reshape(-1), counts
+
+
+def _distances(block: numpy.ndarray, embeddings: numpy.ndarray, squared_norms: numpy.ndarray) -> numpy.ndarray:
+
+    # In place, this is the largest temporary of the whole computation.
+    distances = block @ embeddings.T
+    distances *= -2
+    distances += numpy.einsum('nd,nd->n', block, block)[:, None]
+    distances += squared_norms[None, :]
+
+    numpy.maximum(distances, 0, out=distances)
+
+    return numpy.sqrt(distances, out=distances)
+
+
+def _coefficients(a: numpy.ndarray, b: numpy.ndarray, own_counts: numpy.ndarray) -> numpy.ndarray:
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        coefficients = numpy.nan_to_num((b - a) / numpy.maximum(a, b))
+
+    # Items alone in their cluster score 0, as in sklearn.
+    coefficients[own_counts == 1] = 0
+
+    return coefficients
+
+
+def chunked_silhouette(embeddings: numpy.ndarray, labels: numpy.ndarray, block_size: int = 1024) -> float:
+    """
+    The exact silhouette, computing `block_size` rows of the distance matrix
+    at a time so memory stays O(block_size * (n + clusters)).
+    """
+
+    inverse, counts = _encode_labels(labels)
+
+    # Sorting by label lets the per-cluster sums of a block be taken with reduceat.
+    order = numpy.argsort(inverse, kind='stable')
+    embeddings = embeddings[order]
+    inverse = inverse[order]
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+
+    squared_norms = numpy.einsum('nd,nd->n', embeddings, embeddings)
+    coefficients = numpy.empty(len(embeddings))
+
+    for start in range(0, len(embeddings), block_size):
+        block_labels = inverse[start:start + block_size]
+        rows = numpy.arange(len(block_labels))
+
+        sums = numpy.add.reduceat(_distances(embeddings[start:start + block_size], embeddings, squared_norms), starts, axis=1)
+
+        own_counts = counts[block_labels]
+        a = sums[rows, block_labels] / numpy.maximum(own_counts - 1, 1)
+
+        means = sums / counts[None, :]
+        means[rows, block_labels] = numpy.inf
+        b = means.min(axis=1)
+
+        coefficients[start:start + block_size] = _coefficients(a, b, own_counts)
+
+    return float(coefficients.mean())
+
+
+def simplified_silhouette(embeddings: numpy.ndarray, labels: numpy.ndarray, block_size: int = 1024) -> float:
+    """
+    The simplified silhouette: a and b are the distances to the item's own
+    centroid and to the closest other centroid, so it costs O(n * clusters).
+    """
+
+    inverse, counts = _encode_labels(labels)
+
+    centroids = numpy.zeros((len(counts), embeddings.shape[1]))
+    numpy.add.at(centroids, inverse, embeddings)
+    centroids /= counts[:, None]
+
+    squared_norms = numpy.einsum('kd,kd->k', centroids, centroids)
+    coefficients = numpy.empty(len(embeddings))
+
+    for start in range(0, len(embeddings), block_size):
+        block_labels = inverse[start:start + block_size]
+        rows = numpy.arange(len(block_labels))
+
+        distances = _distances(embeddings[start:start + block_size], centroids, squared_norms)
+
+        a = distances[rows, block_labels].copy()
+        distances[rows, block_labels] = numpy.inf
+        b = distances.min(axis=1)
+
+        coefficients[start:start + block_size] = _coefficients(a, b, counts[block_labels])
+
+    return float(coefficients.mean())
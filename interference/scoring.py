@@ -1,6 +1,6 @@
 import numpy
-from interference.metrics.match import similarity_metric
-from typing import Any, Dict, Optional
+from interference.metrics.match import similarity_metric, similarity_metric_many, similarity_metric_pairwise
+from typing import Any, Dict, Optional, Tuple
 
 from dataclasses import dataclass, field
 
@@ -34,6 +34,26 @@ class ScoringCalculator:
         similarity_score = similarity_metric(embedding1, embedding2)
         return Scoring(similarity_score, similarity_score >= self.scoring_options.score_to_be_match)
 
+    def score_many(self, embedding: numpy.ndarray, embeddings: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Batched version of `__call__`: scores `embedding` against every row of
+        the 2-D `embeddings` and returns the similarity scores and match flags
+        as arrays, without building a `Scoring` per row.
+
+        Subclasses that override `__call__` without overriding this are scored
+        one pair at a time, see `supports_batched`.
+        """
+        similarity_scores = similarity_metric_many(embedding, embeddings)
+        return similarity_scores, similarity_scores >= self.scoring_options.score_to_be_match
+
+    def score_pairwise(self, embeddings1: numpy.ndarray, embeddings2: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Scores every row of `embeddings1` against every row of `embeddings2`,
+        returning (len(embeddings1), len(embeddings2)) score and match arrays.
+        """
+        similarity_scores = similarity_metric_pairwise(embeddings1, embeddings2)
+        return similarity_scores, similarity_scores >= self.scoring_options.score_to_be_match
+
     def describe(self) -> Dict[str, Any]:
         return {
             "scoring_options": self.scoring_options,
@@ -41,3 +61,31 @@ class ScoringCalculator:
                 "similarity_metric(embedding1, embedding2)"
             ]
         }
+
+
+def _defining_class(cls: type, name: str) -> Optional[type]:
+
+    for base in cls.__mro__:
+        if name in vars(base):
+            return base
+
+    return None
+
+
+def supports_batched(calculator: Any, name: str) -> bool:
+    """
+    Whether the batched method `name` of `calculator` can stand in for its
+    `__call__`: it must exist and be defined by the same class as
+    `__call__` or a subclass of it. A calculator that overrides only
+    `__call__` would otherwise be batch-scored by the inherited method.
+    """
+    if not callable(getattr(calculator, name, None)):
+        return False
+
+    method_class = _defining_class(type(calculator), name)
+    call_class = _defining_class(type(calculator), "__call__")
+
+    if method_class is None or call_class is None:
+        return True
+
+    return issubclass(method_class, call_class)
@@ -55,7 +55,6 @@ def on_operation_calculate_matches(interface: "Interface", operation: Operation[
 def _calculate_operation_matches_inner(interface: "Interface", values: Sequence[CalculateMatchesInfo]):
 
     all_instances: "List[Instance]" = []
-    all_scorings: "List[Sequence[Scoring]]" = []
 
     for value_to_match in values:
         instance = interface.try_create_instance_from_value(value_to_match.transformer_key, value_to_match.value)
@@ -65,9 +64,7 @@ def _calculate_operation_matches_inner(interface: "Interface", values: Sequence[
     
         all_instances.append(instance)
 
-        scorings = interface.get_scorings_for(instance)
-
-        all_scorings.append(scorings)
+    all_scorings: "List[Sequence[Scoring]]" = list(interface.get_scorings_for_many(all_instances))
     
     return all_instances, all_scorings
 
@@ -88,7 +85,9 @@ def on_operation_evaluate_matches(interface: "Interface", operation: Operation[E
     return evaluation
 
 def on_operation_evaluate_clusters(interface: "Interface", operation: Operation[EvaluateClustersInfo]):
-    return eval_cluster(interface)
+    info = operation.info
+
+    return eval_cluster(interface, info.silhouette_mode, info.sample_size, info.random_state)
 
 
 def on_operation(interface: "Interface", operation: Operation):
@@ -3,6 +3,8 @@ from typing import Generic, List, TypeVar
 from dataclasses import dataclass, field
 from enum import Enum, unique
 
+from interference.metrics.silhouette import SilhouetteMode
+
 
 @unique
 class OperationType(Enum):
@@ -41,7 +43,10 @@ CalculateMatchesInfo = CalculateScoringInfo
 
 @dataclass()
 class EvaluateClustersInfo():
-    pass
+    silhouette_mode: SilhouetteMode = SilhouetteMode.FULL
+    # Only used by SilhouetteMode.SAMPLED.
+    sample_size: int = 10000
+    random_state: int = 42
 
 
 @dataclass()
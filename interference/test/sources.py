@@ -0,0 +1,162 @@
+import dataclasses
+import json
+import pickle
+
+from enum import Enum
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+import numpy
+
+from interference.metrics.silhouette import SilhouetteMode
+from interference.test.operations import AddInfo, CalculateMatchesInfo, CalculateScoringInfo, EvaluateClustersInfo, EvaluateMatchesInfo, Operation, OperationType, RemoveInfo, UpdateInfo
+
+
+# Each source re-opens its file on every iteration, so one source can be
+# replayed by every test of a TestRunner without being held in memory.
+
+
+class PickleOperations:
+    """
+    Operations pickled one after another into a single file, as written by
+    `write_pickle_operations`, unpickled one at a time. Only read files
+    you trust, unpickling can run arbitrary code.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __iter__(self) -> Iterator[Operation]:
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+
+def write_pickle_operations(path: str, operations: Iterable[Operation]) -> None:
+
+    with open(path, 'wb') as f:
+        for operation in operations:
+            pickle.dump(operation, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class JsonLinesOperations:
+    """
+    One operation per line, as a JSON object with the operation type's name
+    and the fields of its info, for example
+    {"type": "ADD", "info": {"tag": "1", "value": [1, 2], "transformer_key": "numpy"}}.
+    Values for the "numpy" transformer are decoded as arrays.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __iter__(self) -> Iterator[Operation]:
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield operation_from_dict(json.loads(line))
+
+
+def write_json_lines_operations(path: str, operations: Iterable[Operation]) -> None:
+
+    with open(path, 'w') as f:
+        for operation in operations:
+            f.write(json.dumps(operation_to_dict(operation)))
+            f.write('\n')
+
+
+class ExampleOperations:
+    """
+    ADD operations for the points of one of the pickled datasets under
+    `examples/`, tagged by position. Points are either tuples whose first
+    `dimensions` entries are the coordinates, with any label after them,
+    or (array, weight) pairs. The dataset is a single pickled list, so it
+    is loaded whole, but the operations are only built as they are read.
+    """
+
+    def __init__(self, path: str, dimensions: int = 2, transformer_key: str = "numpy") -> None:
+        self.path = path
+        self.dimensions = dimensions
+        self.transformer_key = transformer_key
+
+    def __iter__(self) -> Iterator[Operation]:
+        with open(self.path, 'rb') as f:
+            points = pickle.load(f)
+
+        for tag, point in enumerate(points):
+
+            if isinstance(point[0], numpy.ndarray):
+                value = point[0]
+            else:
+                value = numpy.array(point[:self.dimensions])
+
+            yield Operation(OperationType.ADD, AddInfo(tag=str(tag), value=value, transformer_key=self.transformer_key))
+
+
+def _encode(value: Any) -> Any:
+
+    if dataclasses.is_dataclass(value):
+        return { field.name: _encode(getattr(value, field.name)) for field in dataclasses.fields(value) }
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [ _encode(item) for item in value ]
+
+    return value
+
+
+def operation_to_dict(operation: Operation) -> Dict[str, Any]:
+
+    return { "type": operation.type.name, "info": _encode(operation.info) }
+
+
+def _value_info(cls: Any, info: Dict[str, Any]) -> Any:
+
+    value_info = cls(**info)
+
+    if value_info.transformer_key == "numpy":
+        value_info.value = numpy.array(value_info.value)
+
+    return value_info
+
+
+def operation_from_dict(data: Dict[str, Any]) -> Operation:
+
+    operation_type = OperationType[data["type"]]
+    info: Dict[str, Any] = data["info"]
+    decoded: Optional[Any] = None
+
+    if operation_type == OperationType.ADD:
+        decoded = _value_info(AddInfo, info)
+
+    elif operation_type == OperationType.UPDATE:
+        decoded = _value_info(UpdateInfo, info)
+
+    elif operation_type == OperationType.REMOVE:
+        decoded = RemoveInfo(**info)
+
+    elif operation_type == OperationType.CALCULATE_SCORES:
+        decoded = _value_info(CalculateScoringInfo, info)
+
+    elif operation_type == OperationType.CALCULATE_MATCHES:
+        decoded = _value_info(CalculateMatchesInfo, info)
+
+    elif operation_type == OperationType.EVALUATE_CLUSTERS:
+        decoded = EvaluateClustersInfo(**{
+            **info,
+            **({ "silhouette_mode": SilhouetteMode[info["silhouette_mode"]] } if "silhouette_mode" in info else {})
+        })
+
+    elif operation_type == OperationType.EVALUATE_MATCHES:
+        decoded = EvaluateMatchesInfo(**{
+            **info,
+            "values": [ _value_info(CalculateMatchesInfo, value) for value in info["values"] ]
+        })
+
+    return Operation(operation_type, decoded)
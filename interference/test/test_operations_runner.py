@@ -9,18 +9,33 @@ from interference.interface import Interface
 from interference.test.implementations import on_operation
 from interference.test.operations import Operation, OperationType
 
-from typing import Any, Dict, List, Sequence, Type, TypeVar
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Type, TypeVar
 
 import logging
 
 import json
 import itertools
+import multiprocessing
 import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('test_runner')
 logger.setLevel(logging.INFO)
 
+# The runner a pool worker runs tests for. It reaches forked workers through
+# the parent's memory, so the operations are never pickled.
+_worker_runner: Optional["TestRunner"] = None
+
+
+def _initialize_worker(runner: "TestRunner") -> None:
+    global _worker_runner
+    _worker_runner = runner
+
+
+def _run_test_in_worker(test: Dict[str, Any]) -> str:
+    assert _worker_runner is not None
+    return _worker_runner._run_and_save(test)
+
 
 class TestRunner:
 
@@ -28,7 +43,7 @@ class TestRunner:
         self,
         processor_class: Type[Processor],
         param_grid: Dict[str, Any],
-        operations: List[Operation],
+        operations: Iterable[Operation],
         transformers: Dict[str, TransformerPipeline] = {
             "numpy": NumpyToInstancePipeline(),
             "identity": IdentityPipeline()
@@ -39,6 +54,7 @@ class TestRunner:
         use_last_folder_name_as_processor_class: bool = True,
         output_type: str = 'json',
         skip_done: bool = False,
+        workers: int = 1,
     ):
         self.processor_class = processor_class
         self.param_grid = param_grid
@@ -51,6 +67,7 @@ class TestRunner:
             self.output_folder = output_base_folder
 
         self.skip_done = skip_done
+        self.workers = workers
         self.transformers = transformers
         self.scoring_calculator = scoring_calculator
 
@@ -60,6 +77,13 @@ class TestRunner:
         self.output_type = output_type
         self.tests = self._build_tests()
 
+        # Every test replays the operations, which a one-shot iterator or
+        # generator can only give once. Re-iterable sources, such as those in
+        # interference.test.sources, are read again for each test instead.
+        if len(self.tests) > 1 and iter(operations) is operations:
+            logger.warning("The operations can only be iterated once, keeping all of them in memory for the %d tests.", len(self.tests))
+            self.operations = list(operations)
+
     def _build_tests(self):
 
         test_keys = self.param_grid.keys()
@@ -77,27 +101,63 @@ class TestRunner:
 
     def run_tests(self):
 
+        tests = self._tests_to_run()
+
+        if self.workers <= 1 or len(tests) <= 1:
+
+            for test in tests:
+                self._run_and_save(test)
+
+            return
+
+        # Forked workers share the runner, and its operations, with this
+        # process; with spawn it is pickled once per worker, not per test.
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+
+        with context.Pool(min(self.workers, len(tests)), _initialize_worker, (self,)) as pool:
+
+            for done, file_path in enumerate(pool.imap(_run_test_in_worker, tests), 1):
+                logger.info("Finished test %d of %d, results at %s", done, len(tests), file_path)
+
+    def _tests_to_run(self) -> List[Dict[str, Any]]:
+
+        tests = []
+
         for test in self.tests:
 
-            interface = self.init_inferface(test)
+            if self.skip_done:
+                file_path = self._get_file_path(self.init_inferface(test).processor, self.output_type)
 
-            file_path = self._get_file_path(interface.processor, self.output_type)
+                if Path(file_path).exists():
+                    logger.info("Skipping test with params %s and output at %s. (file exists)", str(test), file_path)
+                    continue
 
-            if self.skip_done and Path(file_path).exists():
-                logger.info("Skipping test with params %s and output at %s. (file exists)", str(test), file_path)
-                continue
+            tests.append(test)
 
-            logger.info("Started test with params %s", str(test))
+        return tests
 
-            results = self.run_test(interface)
+    def _run_and_save(self, test: Dict[str, Any]) -> str:
 
-            if self.output_type == 'json':
+        interface = self.init_inferface(test)
 
-                self._save_results_json(file_path, interface, results, EnhancedJSONEncoder)
+        file_path = self._get_file_path(interface.processor, self.output_type)
 
-            else:
+        logger.info("Started test with params %s", str(test))
+
+        results = self.run_test(interface)
+
+        if self.output_type == 'json':
+
+            self._save_results_json(file_path, interface, results, EnhancedJSONEncoder)
+
+        else:
+
+            self._save_results_csv(file_path, test, results)
 
-                self._save_results_csv(file_path, test, results)
+        return file_path
 
     def run_test(self, interface: Interface):
 
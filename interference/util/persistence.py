@@ -0,0 +1,100 @@
+import importlib
+import json
+import os
+
+import numpy
+
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, TypeVar
+
+S = TypeVar('S', bound=Sequence)
+
+STATE_FILE = "state.json"
+
+
+def save_state(path: str, kind: str, parameters: Dict[str, Any], arrays: Dict[str, numpy.ndarray]) -> None:
+    """
+    Writes `arrays` to `path` as one .npy file each, without pickle, and
+    `parameters` to a JSON file. `kind` names what was saved, so `load_state`
+    can refuse to load it as something else.
+
+    The JSON file is written last, so a directory without it was never
+    completely saved.
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    state_file = os.path.join(path, STATE_FILE)
+
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+    for name, array in arrays.items():
+        numpy.save(os.path.join(path, name + ".npy"), numpy.asarray(array), allow_pickle=False)
+
+    with open(state_file + ".tmp", "w") as f:
+        json.dump({
+            "kind": kind,
+            "parameters": parameters,
+            "arrays": list(arrays.keys())
+        }, f)
+
+    os.replace(state_file + ".tmp", state_file)
+
+
+def load_state(path: str, kind: str) -> Tuple[Dict[str, Any], Dict[str, numpy.ndarray]]:
+    """
+    Reads what `save_state` wrote. The arrays are memory-mapped read-only, so
+    callers copy whatever they go on to modify.
+    """
+
+    with open(os.path.join(path, STATE_FILE)) as f:
+        state = json.load(f)
+
+    if state["kind"] != kind:
+        raise ValueError(f"{path} holds a saved {state['kind']}, not a {kind}.")
+
+    arrays = {
+        name: numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r", allow_pickle=False)
+        for name in state["arrays"]
+    }
+
+    return state["parameters"], arrays
+
+
+def tags_to_array(tags: Iterable[str]) -> numpy.ndarray:
+
+    return numpy.array(list(tags), dtype=str)
+
+
+def split_by_counts(values: S, counts: numpy.ndarray) -> List[S]:
+    """
+    Splits flat `values` back into the consecutive groups of `counts` items
+    they were concatenated from. Pass a list rather than a memory-mapped
+    array when there are many groups, slicing lists is much cheaper.
+    """
+
+    ends = numpy.cumsum(counts).tolist()
+
+    return [values[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+
+def type_name(cls: type) -> str:
+    """
+    The importable name of `cls`, as read back by `saved_type`.
+    """
+
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def saved_type(name: str) -> Any:
+    """
+    The type named by `type_name`. Only types of this package are loaded,
+    so a saved state cannot make `load` import arbitrary modules.
+    """
+
+    module_name, _, class_name = name.rpartition(".")
+
+    if not module_name.startswith("interference."):
+        raise ValueError(f"Refusing to load type {name}.")
+
+    return getattr(importlib.import_module(module_name), class_name)
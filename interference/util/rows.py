@@ -0,0 +1,67 @@
+from typing import Dict, Generic, Hashable, Iterable, List, Sequence, TypeVar
+
+import numpy as np
+
+
+K = TypeVar("K", bound=Hashable)
+
+
+class RowIndex(Generic[K]):
+    """
+    Maps keys to the rows of arrays kept next to it. Rows are handed out in
+    order and removing a key moves the last row into its slot, so the used
+    rows of those arrays are always the first `len(index)`.
+    """
+
+    def __init__(self, keys: Iterable[K] = ()) -> None:
+
+        # keys[row] is the key of row, rows[key] the row of key.
+        self.keys: List[K] = list(keys)
+        self.rows: Dict[K, int] = { key: row for row, key in enumerate(self.keys) }
+
+    def __len__(self) -> int:
+
+        return len(self.keys)
+
+    def __contains__(self, key: K) -> bool:
+
+        return key in self.rows
+
+    def __getitem__(self, key: K) -> int:
+
+        return self.rows[key]
+
+    def append(self, key: K) -> int:
+        """
+        Gives `key` the next free row and returns it. The caller makes sure
+        its arrays have room for it.
+        """
+
+        row = len(self.keys)
+
+        self.keys.append(key)
+        self.rows[key] = row
+
+        return row
+
+    def remove(self, key: K, arrays: Sequence[np.ndarray]) -> None:
+        """
+        Frees the row of `key` by moving the last row of each of `arrays`
+        into it.
+        """
+
+        row = self.rows.pop(key)
+        last_key = self.keys.pop()
+        last_row = len(self.keys)
+
+        if row != last_row:
+
+            for array in arrays:
+                array[row] = array[last_row]
+
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+
+    def get_rows(self, keys: Sequence[K]) -> np.ndarray:
+
+        return np.fromiter((self.rows[key] for key in keys), dtype=np.int64, count=len(keys))
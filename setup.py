@@ -133,7 +133,6 @@ setup(
     # For an analysis of "install_requires" vs pip's requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
-        "faiss-cpu==1.6.5",
         "joblib==1.0.0; python_version >= '3.6'",
         "numpy==1.19.4",
         "scikit-learn==0.24.0; python_version >= '3.6'",
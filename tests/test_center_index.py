@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from interference.clusters.center_index import KDTreeCenterIndex
+from interference.clusters.ecm import ECM
+
+
+class TestKDTreeCenterIndex(unittest.TestCase):
+
+    def test_same_assignments_as_full_scan(self):
+
+        rng = np.random.RandomState(0)
+        embeddings = rng.uniform(0, 1, (3000, 2))
+
+        for distance_threshold in (0.005, 0.02, 0.1):
+            with self.subTest(distance_threshold=distance_threshold):
+
+                scan = ECM(distance_threshold)
+                indexed = ECM(distance_threshold, KDTreeCenterIndex(min_dirty=8))
+
+                for step, embedding in enumerate(embeddings):
+                    tag = str(rng.randint(0, 1000))
+
+                    for ecm in (scan, indexed):
+                        if step % 7 == 3 and tag in ecm.tag_to_cluster:
+                            ecm.remove(tag)
+                        elif tag in ecm.tag_to_cluster:
+                            ecm.update(tag, embedding)
+                        else:
+                            ecm.process(tag, embedding)
+
+                    self.assertEqual(scan.tag_to_cluster, indexed.tag_to_cluster)
+
+                queries = rng.uniform(-0.5, 1.5, (200, 2))
+
+                self.assertEqual(list(scan.predict_many(queries)), list(indexed.predict_many(queries)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+
+import numpy as np
+
+from interference.clusters.ecm import ECM
+from interference.evaluation.cluster import eval_cluster
+from interference.interface import Interface
+from interference.metrics.silhouette import SilhouetteMode
+from interference.scoring import ScoringCalculator
+from interference.transformers.transformer_pipeline import Instance
+
+
+class TestEvalCluster(unittest.TestCase):
+
+    def test_cluster_with_zero_mean_similarity(self):
+
+        interface = Interface(ECM(5.0), {}, ScoringCalculator())
+        interface.add("a", Instance(None, np.array([1.0, 0.0])))
+        interface.add("b", Instance(None, np.array([0.0, 1.0])))
+
+        self.assertEqual(len(interface.processor.get_cluster_ids()), 1)
+
+        evaluation = eval_cluster(interface, SilhouetteMode.NONE)
+
+        self.assertEqual(evaluation["cluster_score"], 0.0)
+        self.assertEqual(evaluation["average cluster cohesion"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
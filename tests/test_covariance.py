@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from interference.clusters.covariance import CovarianceCluster
+
+
+def separated_blobs(count: int = 5, points: int = 2000, std: float = 0.3, separation: float = 10.0):
+
+    rng = np.random.RandomState(0)
+    centers = rng.randn(count, 2)
+    distances = np.linalg.norm(centers[:, None] - centers[None], axis=2)[np.triu_indices(count, 1)]
+    centers *= separation / distances.min()
+
+    labels = rng.randint(0, count, points)
+    return centers[labels] + rng.randn(points, 2) * std, labels
+
+
+class TestCovarianceCluster(unittest.TestCase):
+
+    def test_separated_blobs_are_one_cluster_each(self):
+
+        embeddings, labels = separated_blobs()
+
+        for initial_std in (0.5, 2.0):
+            with self.subTest(initial_std=initial_std):
+
+                cluster = CovarianceCluster(2, initial_std)
+                for tag, embedding in enumerate(embeddings):
+                    cluster.process(str(tag), embedding)
+
+                predicted = np.array([ cluster.get_cluster_by_tag(str(tag)) for tag in range(len(embeddings)) ])
+
+                self.assertEqual(len(set(predicted)), 5)
+                for label in range(5):
+                    self.assertEqual(len(set(predicted[labels == label])), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from interference.clusters.ecm import ECM
+from interference.embedding_store import MemmapEmbeddingStore
+from interference.interface import Interface
+from interference.scoring import ScoringCalculator
+from interference.transformers.transformer_pipeline import Instance
+
+
+class TestInterfaceStatistics(unittest.TestCase):
+
+    def test_reopened_store_with_new_processor(self):
+
+        with tempfile.TemporaryDirectory() as path:
+
+            store = MemmapEmbeddingStore(path, 2)
+            store.add("a", np.array([1.0, 0.0]))
+            store.add("b", np.array([0.0, 1.0]))
+            store.close()
+
+            interface = Interface(ECM(0.3), {}, ScoringCalculator(), embedding_store=MemmapEmbeddingStore(path))
+
+            self.assertEqual(len(interface.cluster_statistics), 0)
+
+            interface.add("a", Instance(None, np.array([1.0, 0.1])))
+            interface.add("c", Instance(None, np.array([1.0, 0.0])))
+
+            self.assertEqual(sum(interface.cluster_statistics.counts.values()), 2)
+
+            interface.processor.process("b", interface.embedding_store["b"])
+            interface.rebuild_statistics()
+
+            self.assertEqual(sum(interface.cluster_statistics.counts.values()), 3)
+
+
+class TestTopKMatches(unittest.TestCase):
+
+    def test_min_score_decides_is_match(self):
+
+        class ScalarScoringCalculator(ScoringCalculator):
+            score_many = None
+
+        rng = np.random.RandomState(0)
+        embeddings = rng.randn(50, 4)
+
+        for calculator in (ScoringCalculator(), ScalarScoringCalculator()):
+            with self.subTest(calculator=type(calculator).__name__):
+
+                interface = Interface(ECM(100.0), {}, calculator)
+                for tag, embedding in enumerate(embeddings):
+                    interface.add(str(tag), Instance(None, embedding))
+
+                matches = interface.get_top_k_matches(Instance(None, embeddings[0]), 50, min_score=-1.0)
+
+                self.assertEqual(len(matches), 50)
+                self.assertTrue(all(scoring.is_match for scoring in matches))
+
+
+if __name__ == "__main__":
+    unittest.main()